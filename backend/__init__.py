@@ -1,15 +1,28 @@
 from backend.constants import CONSTANTS
+from backend import log
 import os
 import backend.database
+import backend.helper_functions
+import backend.metrics
 import backend.routes
+import backend.media.encoding
+import backend.media.sweeper
 
 
 def initialize(app, *others_to_initialize):
+    log.setup()
     if not os.path.isdir(CONSTANTS.video_folder):
         os.makedirs(CONSTANTS.video_folder)
     if not os.path.isdir(CONSTANTS.thumbnail_folder):
         os.makedirs(CONSTANTS.thumbnail_folder)
+    if not os.path.isdir(CONSTANTS.spool_folder):
+        os.makedirs(CONSTANTS.spool_folder)
 
-    to_initialize = [backend.routes, backend.database, *others_to_initialize]
+    to_initialize = [backend.routes, backend.database, backend.helper_functions, backend.metrics, *others_to_initialize]
     for obj in to_initialize:
-        obj.init_app(app)
\ No newline at end of file
+        obj.init_app(app)
+
+    if CONSTANTS.encoding_recovery_interval:
+        backend.media.encoding.start_job_recovery(app, CONSTANTS.encoding_recovery_interval)
+    if CONSTANTS.gc_interval:
+        backend.media.sweeper.start_scheduled_sweeps(app, CONSTANTS.gc_interval)
\ No newline at end of file
@@ -2,6 +2,11 @@ from enum import Enum
 import os
 
 
+def _env_mapping(name: str, convert):
+    '''Parses an environment variable like key=value,key=value'''
+    return {key: convert(value) for key, value in (item.split('=') for item in os.getenv(name, '').split(',') if item)}
+
+
 class DBINFO:
     host = "some.url"
     user = os.getenv('DB_USER', '')
@@ -15,7 +20,44 @@ class CONSTANTS:
     database_info = DBINFO
     auth_cookie_expiration = 30 * 24 * 60 * 60  # 30 days
     app_id = os.getenv('APP_ID', 'someidhere')
+    jwt_cache_size = int(os.getenv('JWT_CACHE_SIZE', '4096'))  # verified and minted tokens kept in memory, 0 disables
+    minted_token_ttl = 10 * 60  # a reused token is at most this old
     video_folder = os.path.join('.', 'videos')
     thumbnail_folder = os.path.join('.', 'thumbs')
+    spool_folder = os.path.join('.', 'spool')
+    encoding_workers = int(os.getenv('ENCODING_WORKERS', '2'))
+    # jobs queued or encoding for longer than this were lost by a worker restart and are resubmitted or failed
+    encoding_job_timeout = float(os.getenv('ENCODING_JOB_TIMEOUT', str(60 * 60)))
+    # seconds between checks for such jobs, the first one at startup. 0 disables them
+    encoding_recovery_interval = float(os.getenv('ENCODING_RECOVERY_INTERVAL', '600'))
+    decode_workers = int(os.getenv('DECODE_WORKERS', str(os.cpu_count() or 1)))
+    decode_batch_size = 8
+    # media responses can be handed to the front proxy: '' (python streams the file),
+    # 'x-accel-redirect' (nginx) or 'x-sendfile' (apache, lighttpd)
+    media_offload = os.getenv('MEDIA_OFFLOAD', '').lower()
+    # internal nginx locations serving each folder, used by x-accel-redirect
+    media_offload_locations = {
+        video_folder: os.getenv('VIDEO_OFFLOAD_LOCATION', '/protected/videos/'),
+        thumbnail_folder: os.getenv('THUMBNAIL_OFFLOAD_LOCATION', '/protected/thumbs/'),
+    }
+    media_url_ttl = 60 * 60  # signed media urls stay valid between 1 and 2 hours
+    default_page_size = 50
+    max_page_size = 500
+    gc_grace_period = 24 * 60 * 60  # 1 day
+    gc_interval = float(os.getenv('GC_INTERVAL', '0'))  # seconds, 0 disables the in-process sweeper
+    gc_lock_path = os.getenv('GC_LOCK_PATH', os.path.join('.', 'sweeper.lock'))  # one worker at a time sweeps
+
+    metrics_token = os.getenv('METRICS_TOKEN', '')  # when set, /metrics requires 'Authorization: Bearer <token>'
 
     debug = True
+    log_level = os.getenv('LOG_LEVEL', 'DEBUG' if debug else 'INFO').upper()
+    # share of the requests whose debug and info records are kept, overridable per endpoint with
+    # LOG_SAMPLE_RATES=patientsessions=0.1,video=0.01
+    log_sample_rate = float(os.getenv('LOG_SAMPLE_RATE', '1'))
+    log_sample_rates = _env_mapping('LOG_SAMPLE_RATES', float)
+    slow_query_threshold = float(os.getenv('SLOW_QUERY_MS', '200')) / 1000  # seconds
+    # statements a request may run before a warning is logged, overridable per endpoint with
+    # QUERY_BUDGETS=professionallinking=4,patientsessions=3
+    query_budget = int(os.getenv('QUERY_BUDGET', '20'))
+    query_budgets = _env_mapping('QUERY_BUDGETS', int)
+    query_budget_strict = os.getenv('QUERY_BUDGET_STRICT', '') == '1'  # raise instead, for tests
@@ -28,6 +28,7 @@ from backend import helper_functions
 from backend import jwt_classes
 from backend.jwt_classes.access_levels import AccessLevels
 from backend.constants import CONSTANTS
+from backend.database import instrumentation
 from backend.database.column_types import (
     Base,
     Binary,
@@ -42,6 +43,7 @@ from backend.database.column_types import (
     StringMedium,
     StringSmall,
     Table,
+    TableIndex,
     db,
     relationship,
     Gettable,
@@ -57,6 +59,12 @@ if TYPE_CHECKING:
 
 def init_app(app):
     db.init_app(app)
+    instrumentation.init_app(app)
+
+
+class OwnerType:
+    patient = 'patient'
+    professional = 'professional'
 
 
 class Authorization(Base, Gettable):
@@ -64,6 +72,7 @@ class Authorization(Base, Gettable):
     email = Column(StringSmall, unique=True)
     password = Column(Binary(64))
     salt = Column(Binary(128))
+    owner_type = NullColumn(StringSmall)  # null on rows not yet backfilled by migrate_owner_type
 
     # relationships
     _patient: Optional[Patient] = relationship('Patient', back_populates='authorization', uselist=False)
@@ -71,7 +80,11 @@ class Authorization(Base, Gettable):
 
     @property
     def owner(self):
-        if self._patient is not None:
+        if self.owner_type == OwnerType.patient:
+            return self._patient
+        elif self.owner_type == OwnerType.professional:
+            return self._professional
+        elif self._patient is not None:
             return self._patient
         elif self._professional is not None:
             return self._professional
@@ -98,7 +111,7 @@ class Patient(Base, Gettable):
     name = Column(StringSmall)
     cpf = Column(StringSmall, unique=True)
     game_config = Column(StringBig)
-    authorization_id = Column(Index, ForeignKey(Authorization.id))
+    authorization_id = Column(Index, ForeignKey(Authorization.id), index=True)
 
     # relationships
     authorization: Authorization = relationship(Authorization, back_populates='_patient')
@@ -139,7 +152,7 @@ class Professional(Base, Gettable):
     cpf = Column(StringSmall, unique=True)
     registration_id = Column(StringSmall, unique=True)
     institution = Column(StringSmall)
-    authorization_id = Column(Index, ForeignKey(Authorization.id))
+    authorization_id = Column(Index, ForeignKey(Authorization.id), index=True)
 
     # relationships
     authorization: Authorization = relationship(Authorization, back_populates='_professional')
@@ -180,6 +193,11 @@ class Link(Base, Gettable):
     professional_id = Column(Index, ForeignKey(Professional.id))
     accepted = Column(Boolean, default=False)
 
+    __table_args__ = (
+        TableIndex('ix_link_professional_accepted_patient', 'professional_id', 'accepted', 'patient_id'),
+        TableIndex('ix_link_patient_professional', 'patient_id', 'professional_id'),
+    )
+
     # relationships
     patient: Patient = relationship(Patient, back_populates='_links')
     professional: Professional = relationship(Professional, back_populates='_links')
@@ -187,12 +205,47 @@ class Link(Base, Gettable):
 
 class VideoInfo(Base, Gettable):
     id = Column(Index, primary_key=True)
-    video_path = Column(StringSmall, unique=True)
-    thumbnail_path = Column(StringSmall, unique=True)
+    # content-addressed, rows storing identical content share the file
+    video_path = Column(StringSmall, index=True)
+    thumbnail_path = Column(StringSmall, index=True)
     date = Column(DateTime)
     patient_id = Column(Index, ForeignKey(Patient.id))
 
+    __table_args__ = (TableIndex('ix_video_info_patient_date', 'patient_id', 'date'), )
+
     # relationships
     patient: Patient = relationship(Patient, back_populates='videos')
 
 
+class EncodingJobStatus:
+    queued = 'queued'
+    encoding = 'encoding'
+    done = 'done'
+    failed = 'failed'
+
+
+class EncodingJob(Base, Gettable):
+    id = Column(Index, primary_key=True)
+    status = Column(StringSmall, default=EncodingJobStatus.queued)
+    spool_path = Column(StringSmall, unique=True)
+    date = Column(DateTime)
+    patient_id = Column(Index, ForeignKey(Patient.id))
+    video_id = NullColumn(Index, ForeignKey(VideoInfo.id))
+    error = NullColumn(StringMedium)
+    updated = NullColumn(DateTime, default=helper_functions.datetime_now)  # last status change
+
+    # relationships
+    patient: Patient = relationship(Patient)
+    video: Optional[VideoInfo] = relationship(VideoInfo)
+
+
+class UploadSession(Base, Gettable):
+    id = Column(Index, primary_key=True)
+    spool_path = Column(StringSmall, unique=True)
+    date = Column(DateTime)
+    patient_id = Column(Index, ForeignKey(Patient.id))
+    job_id = NullColumn(Index, ForeignKey(EncodingJob.id))
+
+    # relationships
+    patient: Patient = relationship(Patient)
+    job: Optional[EncodingJob] = relationship(EncodingJob)
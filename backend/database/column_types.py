@@ -54,6 +54,7 @@ if TYPE_CHECKING:
         relationship: Type[orm.relationship]
         TypeDecorator: Type[type_api.TypeDecorator]
         Table: Type[schema.Table]
+        Index: Type[schema.Index]
         session: Session
         Model: Type[Modell]
         Integer: Any
@@ -93,6 +94,7 @@ _relationship = models.relationship
 # backref = models.backref # chose to not use this. Zen of python: explicit is better than implicit. Use back_populates
 
 Table = models.Table
+TableIndex = models.Index  # Index is the integer id type below
 TypeDecorator = db.TypeDecorator
 
 
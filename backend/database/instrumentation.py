@@ -0,0 +1,135 @@
+import contextlib
+import time
+from typing import Any, Iterator, List
+
+import flask
+import sqlalchemy
+
+from backend import log
+from backend import metrics
+from backend.constants import CONSTANTS
+from backend.database.column_types import db
+
+logger = log.get_logger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryStats:
+    '''Statements run by one request'''
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+@contextlib.contextmanager
+def count_queries(engine=None) -> Iterator[List[str]]:
+    '''Collects the statements executed while the block runs. Must run inside an application context'''
+    engine = engine or db.engine
+    statements: List[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        sqlalchemy.event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@contextlib.contextmanager
+def assert_max_queries(count: int, engine=None) -> Iterator[List[str]]:
+    '''Fails if the block executes more than count statements, to catch N+1 regressions of an endpoint:
+
+        with assert_max_queries(4):
+            client.get('/api/v1/professional/link')
+    '''
+    with count_queries(engine) as statements:
+        yield statements
+
+    if len(statements) > count:
+        raise AssertionError(f'{len(statements)} queries executed, expected at most {count}:\n' +
+                             '\n'.join(statements))
+
+
+def _format_parameters(parameters: Any) -> str:
+    '''Bound parameters, without binary values (password hashes, salts)'''
+    def hide_binary(value):
+        return f'<{len(value)} bytes>' if isinstance(value, (bytes, bytearray, memoryview)) else value
+
+    if isinstance(parameters, dict):
+        parameters = {key: hide_binary(value) for key, value in parameters.items()}
+    elif isinstance(parameters, (list, tuple)):
+        parameters = [_format_parameters(p) if isinstance(p, (dict, list, tuple)) else hide_binary(p) for p in parameters]
+    text = repr(parameters)
+    return text if len(text) <= 1000 else text[:1000] + '...'
+
+
+def _request_stats():
+    if not flask.has_request_context():
+        return None
+    return flask.g.get('query_stats', None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start', None)
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    metrics.add_stage_time('db', elapsed)
+
+    stats = _request_stats()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+
+    if elapsed >= CONSTANTS.slow_query_threshold:
+        logger.warning('Slow query (%.1f ms): %s | parameters: %s', elapsed * 1000, statement,
+                       log.Lazy(_format_parameters, parameters))
+
+
+def _handle_error(exception_context):
+    if exception_context.connection is None:
+        return
+    starts = exception_context.connection.info.get('query_start', None)
+    if starts:
+        starts.pop()
+
+
+def _start_request():
+    flask.g.query_stats = QueryStats()
+
+
+def _check_query_budget(response: flask.Response) -> flask.Response:
+    stats = _request_stats()
+    if stats is None:
+        return response
+
+    endpoint = flask.request.endpoint
+    logger.debug('%s ran %s queries in %.1f ms', endpoint, stats.count, stats.seconds * 1000)
+    budget = CONSTANTS.query_budgets.get(endpoint, CONSTANTS.query_budget)
+    if stats.count > budget:
+        msg = f'{endpoint} ran {stats.count} queries, over its budget of {budget}'
+        if CONSTANTS.query_budget_strict:
+            raise QueryBudgetExceeded(msg)
+        logger.warning(msg)
+    return response
+
+
+def init_app(app: flask.Flask):
+    '''Times every statement once, for the db stage of the metrics, the query count and budget of the request and
+    the slow query log'''
+    engine = sqlalchemy.engine.Engine
+    if not sqlalchemy.event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        sqlalchemy.event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        sqlalchemy.event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        sqlalchemy.event.listen(engine, 'handle_error', _handle_error)
+    app.before_request(_start_request)
+    app.after_request(_check_query_budget)
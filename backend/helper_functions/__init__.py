@@ -26,6 +26,8 @@ import flask
 from travel_backpack.variables import ensure_type
 
 from backend import jwt_classes
+from backend import log
+from backend import metrics
 from backend.jwt_classes import is_type
 
 from backend.helper_functions.time import *
@@ -36,6 +38,7 @@ except:
     from typing_extensions import Literal
 
 T = TypeVar('T')
+logger = log.get_logger(__name__)
 
 
 def generate_cryptographically_random_string(size: int = 8) -> str:
@@ -65,7 +68,7 @@ def are_fields_missing(json: Dict[str, Any],
     missing_fields = get_missing_fields(json, fields)
     if missing_fields:
         msg = 'Missing fields: ' + ', '.join(missing_fields)
-        print(msg)
+        logger.info(msg)
         return True, msg
 
     return False, None
@@ -92,17 +95,15 @@ def convert_jwt_types(variables: Dict[str, Any], types: Dict[str, Type], subject
                 return jwt_classes.is_type(var, variable_type, subject=subject)
 
             except jwt_classes.JwtObjectDecodeError as ex:
-                print(ex)
-                print('invalid jwt object')
+                logger.info('Invalid jwt object: %s', ex)
                 raise ConversionError('invalild token->Invalid jwt object')
 
             except jwt_classes.JwtObjectCreationError as ex:
-                print(ex)
-                print('Probably old jwt object structure')
+                logger.info('Probably old jwt object structure: %s', ex)
                 raise ConversionError('invalid token->Probably old jwt object structure')
 
             except jwt.DecodeError:
-                print('invalid jwt')
+                logger.info('Invalid jwt')
                 raise ConversionError('invalild token->Invalid jwt')
 
         elif hasattr(variable_type, '__origin__') and variable_type.__origin__ == Union:
@@ -184,28 +185,48 @@ def check_user_auth_token(token: str):
         return jwt_classes.Authorization.from_jwt(token, subject=None)
 
     except jwt_classes.JwtObjectDecodeError as ex:
-        print(ex)
-        print('invalid jwt object')
+        logger.info('Invalid jwt object: %s', ex)
         flask.abort(
             HTTPStatus.UNAUTHORIZED,
             description="Invalid Token object",
         )
     except jwt_classes.JwtObjectCreationError as ex:
-        print(ex)
-        print('Probably old jwt object structure')
+        logger.info('Probably old jwt object structure: %s', ex)
         flask.abort(
             HTTPStatus.UNAUTHORIZED,
             description="Invalid Token. Please request a new one",
         )
 
     except jwt.DecodeError:
-        print('invalid jwt')
+        logger.info('Invalid jwt')
         flask.abort(
             HTTPStatus.UNAUTHORIZED,
             description="Invalid Token",
         )
 
 
+def request_auth_token() -> Optional[jwt_classes.Authorization]:
+    '''The Authorization cookie of the current request, verified once and kept on flask.g. None if missing'''
+    if 'auth_token' not in flask.g:
+        token = flask.request.cookies.get('Authorization', None)
+        if token is None:
+            flask.g.auth_token = None
+        else:
+            with metrics.stage('jwt_decode'):
+                flask.g.auth_token = check_user_auth_token(token)
+    return flask.g.auth_token
+
+
+def _forget_request_auth():
+    '''flask.g lives as long as the app context, which several requests may share, e.g. in tests'''
+    flask.g.pop('auth_token', None)
+    flask.g.pop('authorization', None)
+
+
+def init_app(app):
+    app.before_request(_forget_request_auth)
+
+
 def first_or_abort(generator: Iterator[T], error_message: str, error_code: int = HTTPStatus.NOT_FOUND) -> T:
     try:
         return next(generator)
@@ -239,4 +260,4 @@ class copy_signature(Generic[F]):
         ...
 
 
-from backend.helper_functions.decorators import *
\ No newline at end of file
+from backend.helper_functions.decorators import *
@@ -1,9 +1,7 @@
 from backend.helper_functions.time import timestamp_to_datetime
-from backend.constants import CONSTANTS
 from backend.jwt_classes import JwtObject
 from backend import database
 import functools
-from copy import deepcopy
 from http import HTTPStatus
 import inspect
 from pprint import pformat
@@ -26,15 +24,21 @@ from typing import (
 
 import flask
 import jwt
+import sqlalchemy.orm
 
 from backend import jwt_classes
-from backend.helper_functions import check_missing_fields, check_types, check_user_auth_token, convert_jwt_types
+from backend import log
+from backend import metrics
+from backend import serialization
+from backend.helper_functions import check_missing_fields, check_types, convert_jwt_types, request_auth_token
 
 try:
     from typing import Literal  # type: ignore
 except:
     from typing_extensions import Literal
 
+logger = log.get_logger(__name__)
+
 
 def check_parameters(source: Dict[str, Any], func, type_check: Callable[[Dict[str, Any], Dict[str, Type]], None],
                      subject: Union[str, int, None]):
@@ -57,6 +61,144 @@ def check_parameters(source: Dict[str, Any], func, type_check: Callable[[Dict[st
     return args
 
 
+convertible_types = set((int, float, bool))
+
+
+def convert_types(variables: Dict[str, Any], types: Dict[str, Type]):
+    '''Converts the query string values of int, float and bool parameters'''
+    wrong_types: Set[str] = set()
+
+    for name, variable_type in types.items():
+        if variable_type != inspect.Parameter.empty and variable_type in convertible_types and name in variables:
+            try:
+                variables[name] = variable_type(variables[name])
+            except (TypeError, ValueError):
+                wrong_types.add(name)
+
+    if wrong_types:
+        _abort_wrong_types(wrong_types, types)
+
+
+def _abort_wrong_types(wrong_types: Iterable[str], types: Dict[str, Type]):
+    msg = 'The following variable types are wrong: ' + ', '.join([f'{n} expected {types[n]}' for n in wrong_types])
+    flask.abort(HTTPStatus.BAD_REQUEST, description=msg)
+
+
+class ParameterValidator:
+    '''check_parameters compiled once, when a method is decorated. Each parameter becomes a step holding
+    what the request path needs: whether it is required, its default, the decoder bound to its jwt class
+    and the type to check or convert it to. Signatures with types it does not compile (unions, generics)
+    keep going through check_parameters'''
+    def __init__(self, func, type_check: Callable[[Dict[str, Any], Dict[str, Type]], None]):
+        self.func = func
+        self.type_check = type_check
+        params = tuple(inspect.signature(func).parameters.values())[1:]  # remove first (self)
+        self.types = {p.name: p.annotation for p in params}
+        self.required = tuple(p.name for p in params if p.default == p.empty)
+        self.defaults = {p.name: p.default for p in params if p.default != p.empty}
+        self.jwt_steps: Tuple[Tuple[str, Callable[[Any, Union[str, int, None]], Tuple[bool, Any]]], ...] = ()
+        self.type_steps: Tuple[Tuple[str, Type], ...] = ()
+        self.compiled = True
+
+        for name, param_type in self.types.items():
+            if jwt_classes.is_subclass(param_type, jwt_classes.JwtObject):
+                self.jwt_steps += ((name, self._jwt_decoder(param_type)), )
+                if type_check is check_types:
+                    self.type_steps += ((name, param_type.__origin__), )
+            elif param_type == inspect.Parameter.empty:
+                continue
+            elif hasattr(param_type, '__origin__') or not isinstance(param_type, type):
+                self.compiled = False
+            elif type_check is check_types or param_type in convertible_types:
+                self.type_steps += ((name, param_type), )
+
+        if type_check not in (check_types, convert_types):
+            self.compiled = False
+
+    @staticmethod
+    def _jwt_decoder(param_type):
+        jwt_class = param_type.__origin__
+        access_level = jwt_classes.AccessLevels(param_type.__args__[0].level)
+
+        def decode(value, subject):
+            if isinstance(value, str):
+                value = jwt_class.from_jwt(value, subject=subject, minimum_access_level=access_level)
+            if not isinstance(value, jwt_class):
+                return False, value
+            value.downgrade_access(access_level)
+            return True, value
+
+        return decode
+
+    def __call__(self, source: Dict[str, Any], subject: Union[str, int, None]) -> Dict[str, Any]:
+        if not self.compiled:
+            return check_parameters(source=source, func=self.func, type_check=self.type_check, subject=subject)
+
+        missing = [name for name in self.required if name not in source]
+        if missing:
+            check_missing_fields(source, *missing)
+
+        self._decode_jwts(source, subject)
+        if self.type_check is check_types:
+            self._check_types(source)
+        else:
+            self._convert_types(source)
+
+        args = {name: source[name] for name in self.required}
+        for name, default in self.defaults.items():
+            args[name] = source.get(name, default)
+        return args
+
+    def _decode_jwts(self, source: Dict[str, Any], subject: Union[str, int, None]):
+        wrong_types: Dict[str, str] = {}
+        for name, decode in self.jwt_steps:
+            if name not in source:
+                continue
+            try:
+                with metrics.stage('jwt_decode'):
+                    correct_type, value = decode(source[name], subject)
+            except jwt_classes.JwtObjectDecodeError as ex:
+                logger.info('Invalid jwt object: %s', ex)
+                wrong_types[name] = 'invalild token->Invalid jwt object'
+                continue
+            except jwt_classes.JwtObjectCreationError as ex:
+                logger.info('Probably old jwt object structure: %s', ex)
+                wrong_types[name] = 'invalid token->Probably old jwt object structure'
+                continue
+            except jwt.DecodeError:
+                logger.info('Invalid jwt')
+                wrong_types[name] = 'invalild token->Invalid jwt'
+                continue
+
+            if correct_type:
+                source[name] = value
+            else:
+                wrong_types[name] = f'invalid type->Expected {self.types[name]} but got {type(source[name])}'
+
+        if wrong_types:
+            msg = 'The following variables are wrong: ' + ', '.join([f'{n}: {exp}' for n, exp in wrong_types.items()])
+            flask.abort(HTTPStatus.BAD_REQUEST, description=msg)
+
+    def _check_types(self, source: Dict[str, Any]):
+        wrong_types = [(name, param_type, type(source[name])) for name, param_type in self.type_steps
+                       if name in source and not isinstance(source[name], param_type)]
+        if wrong_types:
+            msg = 'The following variable types are wrong: ' + ', '.join(
+                [f'{n} expected {exp} but got {variable_type}' for n, exp, variable_type in wrong_types])
+            flask.abort(HTTPStatus.BAD_REQUEST, description=msg)
+
+    def _convert_types(self, source: Dict[str, Any]):
+        wrong_types = []
+        for name, param_type in self.type_steps:
+            if name in source:
+                try:
+                    source[name] = param_type(source[name])
+                except (TypeError, ValueError):
+                    wrong_types.append(name)
+        if wrong_types:
+            _abort_wrong_types(wrong_types, self.types)
+
+
 def extract_doc(func, location: str):
     func_inspection = inspect.signature(func)
     params = tuple(func_inspection.parameters.values())[1:]  # remove first (self)
@@ -67,6 +209,7 @@ def extract_doc(func, location: str):
 
     return_types = func_inspection.return_annotation
     response_codes = {}
+    message_codes = set()  # codes described by Literal messages, which are the only ones joined
     if hasattr(return_types, '__args__'):
         for return_type in return_types.__args__:
             if hasattr(return_type, '__origin__') and \
@@ -78,11 +221,21 @@ def extract_doc(func, location: str):
 
                 return_annotation, return_code = return_type.__args__
                 return_code = int(return_code.__args__[0])
-                if hasattr(return_annotation, '__origin__') and return_annotation.__origin__ == Literal:
+                is_message = hasattr(return_annotation, '__origin__') and return_annotation.__origin__ == Literal
+                if is_message:
                     return_annotation = return_annotation.__args__[0]
-                response_codes[return_code] = str(return_annotation)
+                if return_code not in response_codes:
+                    response_codes[return_code] = str(return_annotation)
+                elif is_message and return_code in message_codes:
+                    # several messages share the code
+                    response_codes[return_code] += f' or {return_annotation}'
+                elif is_message:
+                    # a message describes the code better than a bare type
+                    response_codes[return_code] = str(return_annotation)
+                if is_message:
+                    message_codes.add(return_code)
             else:
-                print(return_type)
+                logger.debug('Return type left out of the docs: %s', return_type)
 
     def to_OAS_type(t) -> str:
         if hasattr(t, '__origin__'):
@@ -161,12 +314,7 @@ def extract_doc(func, location: str):
 _extracted_docs = {}
 
 
-def args_from_json(func):
-    """Checks and gets the function args from the json received
-
-    Arguments:
-        func {function} -- the function to be decorated
-    """
+def _register_doc(func, doc: Dict[str, Any]):
     module = func.__module__
     func_class, func_name = func.__qualname__.split('.')
     if module not in _extracted_docs:
@@ -174,75 +322,94 @@ def args_from_json(func):
     if func_class not in _extracted_docs[module]:
         _extracted_docs[module][func_class] = {}
 
-    _extracted_docs[module][func_class][func_name] = extract_doc(func, location='body')
+    # methods documented by more than one decorator get their parameters merged
+    previous = _extracted_docs[module][func_class].get(func_name, None)
+    if previous is not None:
+        doc = {**previous, **doc, 'parameters': previous['parameters'] + doc['parameters']}
 
-    def args_from_json_w(self):  # don't wrap
-        json = {}
-        json.update(flask.request.json)
-        if CONSTANTS.debug:
-            print('JSON received:')
-            _pprint_items(json)
+    _extracted_docs[module][func_class][func_name] = doc
 
-        token = flask.request.cookies.get('Authorization', None)
-        subject = None
-        if token is not None:
-            subject = jwt_classes.Authorization.from_jwt(token, subject=None)._id
-        args = check_parameters(source=json, func=func, type_check=check_types, subject=subject)
-        return func(self, **args)
 
-    return args_from_json_w
+def raw_body(*content_types: str, description: str):
+    """Documents a method that reads the request body itself instead of receiving its fields as arguments
 
+    Arguments:
+        content_types {str} -- the accepted body content types
+        description {str} -- how the body is laid out
+    """
+    def raw_body_d(func):
+        doc = extract_doc(func, location='body')
+        doc['consumes'] = list(content_types)
+        doc['parameters'] = [{
+            "name": "body",
+            "in": "body",
+            "description": description,
+            "schema": {
+                "type": "string",
+                "format": "binary"
+            },
+            "required": True,
+        }]
+        _register_doc(func, doc)
+        return func
+
+    return raw_body_d
 
-def args_from_urlencoded(func):
+
+def args_from_json(func):
     """Checks and gets the function args from the json received
 
     Arguments:
         func {function} -- the function to be decorated
     """
-    module = func.__module__
-    func_class, func_name = func.__qualname__.split('.')
-    if module not in _extracted_docs:
-        _extracted_docs[module] = {}
-    if func_class not in _extracted_docs[module]:
-        _extracted_docs[module][func_class] = {}
+    _register_doc(func, extract_doc(func, location='body'))
+    validator = ParameterValidator(func, type_check=check_types)
+
+    def args_from_json_w(self, **path_args):  # don't wrap
+        json = serialization.request_json()
+        if not isinstance(json, dict):
+            flask.abort(HTTPStatus.BAD_REQUEST, description='Expected a JSON object')
+        json.update(path_args)
+        logger.debug('JSON received: %s', log.Lazy(_format_items, json))
+
+        auth_token = request_auth_token()
+        subject = None if auth_token is None else auth_token._id
+        with metrics.stage('validation'):
+            args = validator(json, subject=subject)
+        return func(self, **args)
 
-    _extracted_docs[module][func_class][func_name] = extract_doc(func, location='query')
+    args_from_json_w.validator = validator
+    return args_from_json_w
 
-    def args_from_urlencoded_w(self):  # don't wrap
-        query_args: Dict[str, str] = {}
-        query_args.update(flask.request.args)
-        if CONSTANTS.debug:
-            print('Query args received:')
-            _pprint_items(query_args)
-
-        token = flask.request.cookies.get('Authorization', None)
-        subject = None
-        if token is not None:
-            subject = jwt_classes.Authorization.from_jwt(token, subject=None)._id
-        args = check_parameters(source=query_args, func=func, type_check=convert_types, subject=subject)
-        return func(self, **args)
 
-    convertible_types = set((int, float, bool))
+def args_from_urlencoded(func):
+    """Checks and gets the function args from the json received
 
-    def convert_types(variables: Dict[str, Any], types: Dict[str, Type]):
-        wrong_types: Set[str] = set()
+    Arguments:
+        func {function} -- the function to be decorated
+    """
+    _register_doc(func, extract_doc(func, location='query'))
+    validator = ParameterValidator(func, type_check=convert_types)
 
-        for name, variable_type in types.items():
-            if variable_type != inspect.Parameter.empty and variable_type in convertible_types and name in variables:
-                try:
-                    variables[name] = variable_type(variables[name])
-                except TypeError:
-                    wrong_types.add(name)
+    def args_from_urlencoded_w(self, **path_args):  # don't wrap
+        query_args: Dict[str, Any] = {}
+        query_args.update(flask.request.args)
+        query_args.update(path_args)
+        logger.debug('Query args received: %s', log.Lazy(_format_items, query_args))
 
-        if wrong_types:
-            msg = 'The following variable types are wrong: ' + ', '.join(
-                [f'{n} expected {types[n]}' for n in wrong_types])
-            flask.abort(HTTPStatus.BAD_REQUEST, description=msg)
+        auth_token = request_auth_token()
+        subject = None if auth_token is None else auth_token._id
+        with metrics.stage('validation'):
+            args = validator(query_args, subject=subject)
+        return func(self, **args)
 
+    args_from_urlencoded_w.validator = validator
     return args_from_urlencoded_w
 
 
-def _pprint_items(obj: Dict[str, Any]):
+def _format_items(obj: Dict[str, Any]) -> str:
+    '''Received arguments with their tokens decoded and dates converted'''
+    lines = []
     for key, value in obj.items():
         try:
             if key.endswith('_token'):
@@ -252,35 +419,83 @@ def _pprint_items(obj: Dict[str, Any]):
                     p_value = jwt.decode(value, verify=False)
             elif key.endswith('_date'):
                 p_value = timestamp_to_datetime(int(value))
+            elif 'password' in key:
+                p_value = '***'
             else:
                 p_value = value
         except Exception as ex:
             p_value = value
-        print(pformat((key, p_value)))
+        lines.append(pformat((key, p_value)))
+    return '\n'.join(['', *lines])
+
+
+def eager_load(*paths: str):
+    """Declares the relationships of the injected database.Authorization that the method uses, so they are loaded
+    up front instead of lazily, one query per object. Goes below inject_user_from_authorization.
+    Only the owners the paths start from are joined, so routes serving a single kind of user declare at least
+    '_patient' or '_professional'
+
+    Arguments:
+        paths {str} -- dotted relationship paths starting at Authorization, e.g. '_professional._links.patient'
+    """
+    def eager_load_d(func):
+        func._eager_load = paths
+        return func
+
+    return eager_load_d
+
+
+def _eager_load_options(model, paths: Iterable[str]):
+    '''Single valued relationships are joined, collections are loaded by a second query each'''
+    options = []
+    for path in paths:
+        option = None
+        cls = model
+        for name in path.split('.'):
+            attribute = getattr(cls, name)
+            loader = sqlalchemy.orm.selectinload if attribute.property.uselist else sqlalchemy.orm.joinedload
+            option = loader(attribute) if option is None else getattr(option, loader.__name__)(attribute)
+            cls = attribute.property.mapper.class_
+        options.append(option)
+    return options
+
+
+def request_authorization(*load_options) -> Optional['database.Authorization']:
+    '''The database.Authorization of the current request's cookie, loaded once and kept on flask.g'''
+    if 'authorization' not in flask.g:
+        auth_token = request_auth_token()
+        flask.g.authorization = None if auth_token is None else \
+            database.Authorization.query.options(*load_options).get(auth_token._id)
+    return flask.g.authorization
 
 
 def inject_user_from_authorization(func):
     signature = inspect.signature(func)
     param = tuple(signature.parameters.values())[1]
     param_type = param.annotation
+    # the owner is needed by nearly every route. When the eager profile names the owner the route serves, the other
+    # one is left out of the query. Authorization.owner_type makes owner load it lazily in the rare request that
+    # needs it, instead of probing _patient on every professional request
+    eager_paths = getattr(func, '_eager_load', ())
+    owners = [owner for owner in ('_patient', '_professional') if any(p.split('.')[0] == owner for p in eager_paths)]
+    load_options = _eager_load_options(database.Authorization,
+                                       (*(owners or ('_patient', '_professional')), *eager_paths))
 
     @functools.wraps(func)  # wrap to preserve original args
     def inject_user_from_authorization_w(self, *args, **kwargs):
-        if 'Authorization' not in flask.request.cookies:
+        authorization = request_auth_token()
+        if authorization is None:
             flask.abort(
                 HTTPStatus.UNAUTHORIZED,
                 description="Missing Authorization cookie",
             )
 
-        token = flask.request.cookies['Authorization']
-        authorization = check_user_auth_token(token)
-
         if issubclass(param_type, int):
             return func(self, authorization._id, *args, **kwargs)
         elif issubclass(param_type, jwt_classes.Authorization):
             return func(self, authorization, *args, **kwargs)
         elif issubclass(param_type, database.Authorization):
-            u = database.Authorization.get(authorization._id)
+            u = request_authorization(*load_options)
             if u is None:
                 raise Exception('Authorization not found in database')
             return func(self, u, *args, **kwargs)
@@ -308,44 +523,34 @@ def remove_parameter(func):
     return remove_parameter_w
 
 
+def _format_result(result: Any) -> str:
+    '''A route result with the tokens it returns decoded'''
+    if not (isinstance(result, tuple) and len(result) >= 1):
+        return str(result)
+
+    def decode_token(item: Any) -> Any:
+        if isinstance(item, dict) and item.get('token', None):
+            item = {**item, 'token': JwtObject.from_any_jwt(item['token'], subject=None).to_dict(human_readable=True)}
+        return item
+
+    body = result[0]
+    if isinstance(body, dict):
+        body = decode_token(body)
+    elif isinstance(body, list):
+        body = [decode_token(item) for item in body]
+    else:
+        return str(result)
+    return pformat((body, *result[1:]), indent=2)
+
+
 def session_remove(func):
     @functools.wraps(func)
     def session_remove_wrapper(*args, **kwargs):
         from backend import database as db  # because of circular imports
+        logger.debug('%s %s (endpoint %s)', flask.request.method, flask.request.path, flask.request.endpoint)
         result = func(*args, **kwargs)
         db.db.session.remove()
+        logger.debug('result: %s', log.Lazy(_format_result, result))
         return result
 
-    @functools.wraps(session_remove_wrapper)
-    def session_remove_wrapper_d(*args, **kwargs):
-        print('\n')
-        print('.')
-        print('path:', flask.request.path)
-        print('method:', flask.request.method)
-        print('endpoint:', flask.request.endpoint)
-        result = session_remove_wrapper(*args, **kwargs)
-        if isinstance(result, tuple) and len(result) >= 1:
-            new_result = deepcopy(result[0])
-            if isinstance(new_result, dict):
-                tok: Optional[str] = new_result.get('token', None)
-                if tok:
-                    new_result['token'] = JwtObject.from_any_jwt(tok, subject=None).to_dict(human_readable=True)
-                print('result:', pformat((new_result, *result[1:]), indent=2))
-            elif isinstance(new_result, list):
-                for i, item in enumerate(new_result):
-                    if isinstance(item, dict):
-                        tok: Optional[str] = item.get('token', None)
-                        if tok:
-                            new_result[i]['token'] = JwtObject.from_any_jwt(tok,
-                                                                            subject=None).to_dict(human_readable=True)
-                print('result:', pformat((new_result, *result[1:]), indent=2))
-            else:
-                print('result:', result)
-        else:
-            print('result:', result)
-        return result
-
-    if CONSTANTS.debug:
-        return session_remove_wrapper_d
-    else:
-        return session_remove_wrapper
+    return session_remove_wrapper
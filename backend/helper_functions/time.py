@@ -45,5 +45,10 @@ def fulldatetime_to_timestamp(date: datetime.datetime):
     return int(date.timestamp())
 
 
+def timestamp_to_fulldatetime(timestamp: int):
+    '''Returns the date of the timestamp with seconds precision'''
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+
+
 def datetime_now():
     return datetime.datetime.now(tz=datetime.timezone.utc)
\ No newline at end of file
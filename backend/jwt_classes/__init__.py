@@ -1,6 +1,8 @@
+import copy
 import datetime
 from typing import (
     Any,
+    Callable,
     Dict,
     Generic,
     Tuple,
@@ -13,7 +15,9 @@ from typing import (
 import jwt
 
 from backend.jwt_classes.access_levels import AccessLevel, AccessLevels
+from backend.jwt_classes.cache import LRUCache
 from backend.constants import CONSTANTS
+from backend import log
 
 
 class JwtObjectDecodeError(Exception):
@@ -30,15 +34,96 @@ class JwtObjectAccessLevelError(JwtObjectDecodeError):
 
 TJwt = TypeVar('TJwt', bound='JwtObject')
 
+logger = log.get_logger(__name__)
+
 jwt_type_map: Dict[int, Type['JwtObject']] = {}
 
+# token string -> payload whose signature was already verified. Only the signature check is skipped on a hit,
+# the type, access level and subject of the payload are checked again on every use
+verified_payloads = LRUCache(CONSTANTS.jwt_cache_size)
+# token content -> token minted for it. Entries expire so that the iat of a reused token stays recent
+minted_tokens = LRUCache(CONSTANTS.jwt_cache_size, ttl=CONSTANTS.minted_token_ttl)
+
+
+def _decode_verified(jwt_str: str) -> Dict[str, Any]:
+    payload = verified_payloads.get(jwt_str)
+    if payload is None:
+        try:
+            payload = jwt.decode(jwt=jwt_str, key=CONSTANTS.key, algorithms='HS256')
+        except jwt.DecodeError:
+            logger.info('Invalid jwt')
+            raise
+        verified_payloads.put(jwt_str, payload)
+    # callers pop fields from the payload and is_type converts list items in place
+    return {k: copy.deepcopy(v) if isinstance(v, (list, dict)) else v for k, v in payload.items()}
+
+
+def is_subclass(variable_type: Type, expected_type: Union[Type, Tuple[Type, ...]]) -> bool:
+    if hasattr(variable_type, '__origin__'):
+        return is_subclass(variable_type.__origin__, expected_type)  # type: ignore
+    else:
+        try:
+            return issubclass(variable_type, expected_type)
+        except:
+            return False
+
+
+_scalar_types = (str, int, float, bool)
+
+
+class FieldPlan:
+    '''The fields of a jwt class visible at one access level, resolved once when the class is created'''
+    def __init__(self, all_annotations: Dict[str, Type], access_level: int):
+        self.annotations: Dict[str, Type] = {}
+        self.hidden: Tuple[str, ...] = ()
+        for field_name, field_type in all_annotations.items():
+            if is_subclass(field_type, AccessLevel) and access_level < field_type.level:
+                self.hidden += (field_name, )
+            else:
+                self.annotations[field_name] = field_type
+
+        self.names = frozenset(self.annotations)
+        self.checkers = tuple((field_name, _field_checker(field_type))
+                              for field_name, field_type in self.annotations.items())
+        # nothing to serialize recursively when every field is a plain value
+        self.flat = all(_resolve_access_level(t) in _scalar_types for t in self.annotations.values())
+
+
+def _resolve_access_level(field_type: Type) -> Type:
+    if is_subclass(field_type, AccessLevel):
+        return field_type.__args__[0]  # type: ignore
+    return field_type
+
+
+def _field_checker(field_type: Type) -> Callable[[Any, Union[str, int, None]], Tuple[bool, Any]]:
+    resolved_type = _resolve_access_level(field_type)
+    if resolved_type in _scalar_types:
+
+        def check_scalar(value, subject):
+            return isinstance(value, resolved_type), value
+
+        return check_scalar
+
+    def check(value, subject):
+        return is_type(value, field_type, subject=subject)
+
+    return check
+
 
 class JwtObjectMeta(type):
     def __new__(cls, name, bases, dct):
         c: Type[JwtObject] = cast(Type['JwtObject'], super().__new__(cls, name, bases, dct))
+        c.__all_fields__ = dict(dct.get('__annotations__', {}))
+        c.__field_plans__ = {level.value: FieldPlan(c.__all_fields__, level.value) for level in AccessLevels}
         jwt_type_map[c.__type__] = c
         return c
 
+    def field_plan(cls, access_level: int) -> FieldPlan:
+        plan = cls.__field_plans__.get(access_level, None)
+        if plan is None:
+            plan = cls.__field_plans__[access_level] = FieldPlan(cls.__all_fields__, access_level)
+        return plan
+
 
 AL = TypeVar('AL')
 
@@ -49,47 +134,38 @@ class JwtObject(Generic[AL], metaclass=JwtObjectMeta):
     sub = None
 
     def __init__(self, subject: Union[str, int, None], access_level: AccessLevels = AccessLevels.max, **kwargs):
-        if not hasattr(self, '__annotations__'):
-            self.__annotations__ = {}
         self.__access_level__ = access_level.value
         self.sub = subject
-
-        all_fields = set(self.__annotations__)
-        required_fields = set(self.annotations)
-
-        given_fields = set(kwargs)
-        missing_fields = required_fields - given_fields
-        extra_fields = given_fields - all_fields
-        error_msgs = []
-        if missing_fields:
-            error_msgs.append(f'Missing fields: {list(missing_fields)}')
-        if extra_fields:
-            error_msgs.append(f'Extra fields: {list(extra_fields)}')
-        if error_msgs:
-            raise JwtObjectCreationError(f'Error instantiating token of type {self.__type__}. ' +
-                                         ' & '.join(error_msgs))
-
-        for variable_name, variable_type in self.annotations.items():
-            value = kwargs.pop(variable_name)
-            correct_type, value = is_type(value, variable_type, subject=self.sub)
+        plan = type(self).field_plan(self.__access_level__)
+
+        if plan.names != kwargs.keys():
+            given_fields = set(kwargs)
+            missing_fields = plan.names - given_fields
+            extra_fields = given_fields - set(self.__all_fields__)
+            error_msgs = []
+            if missing_fields:
+                error_msgs.append(f'Missing fields: {list(missing_fields)}')
+            if extra_fields:
+                error_msgs.append(f'Extra fields: {list(extra_fields)}')
+            if error_msgs:
+                raise JwtObjectCreationError(f'Error instantiating token of type {self.__type__}. ' +
+                                             ' & '.join(error_msgs))
+
+        for variable_name, check in plan.checkers:
+            value = kwargs[variable_name]
+            correct_type, value = check(value, self.sub)
             if correct_type:
                 setattr(self, variable_name, value)
             else:
-                raise ValueError(f'{variable_name} is not of type {variable_type}. is {type(value)}')
+                raise ValueError(f'{variable_name} is not of type {plan.annotations[variable_name]}. is {type(value)}')
 
     @property
     def annotations(self) -> Dict[str, Type]:
-        annotations: Dict[str, Type] = {}
-        for field_name, field_type in self.__annotations__.items():
-            if is_subclass(field_type, AccessLevel):
-                if self.__access_level__ < field_type.level:
-                    continue
-
-            annotations[field_name] = field_type
-        return annotations
+        return type(self).field_plan(self.__access_level__).annotations
 
     def to_dict(self, human_readable: bool = False):
-        d = {variable_name: getattr(self, variable_name) for variable_name in self.annotations}
+        plan = type(self).field_plan(self.__access_level__)
+        d = {variable_name: getattr(self, variable_name) for variable_name in plan.annotations}
 
         def recurse(d):
             if isinstance(d, dict):
@@ -113,7 +189,8 @@ class JwtObject(Generic[AL], metaclass=JwtObjectMeta):
                     elif isinstance(item, (list, dict)):
                         recurse(item)
 
-        recurse(d)
+        if not plan.flat:
+            recurse(d)
         if human_readable:
             d['__type__'] = f'{jwt_type_map[self.__type__].__name__} ({self.__type__})'
             d['__access_level__'] = AccessLevels(self.__access_level__).name
@@ -124,7 +201,24 @@ class JwtObject(Generic[AL], metaclass=JwtObjectMeta):
         return d
 
     def to_jwt(self):
+        return self._encode(self.to_dict())
+
+    def to_cached_jwt(self):
+        '''Like to_jwt, but reuses the token minted for the same fields, subject and access level
+        in the last CONSTANTS.minted_token_ttl seconds. Any change to the fields mints a new one'''
         data = self.to_dict()
+        if not type(self).field_plan(self.__access_level__).flat:
+            return self._encode(data)
+
+        key = tuple(sorted(data.items()))
+        token = minted_tokens.get(key)
+        if token is None:
+            token = self._encode(data)
+            minted_tokens.put(key, token)
+        return token
+
+    @staticmethod
+    def _encode(data: Dict[str, Any]) -> str:
         data['iat'] = datetime.datetime.utcnow()
         data['iss'] = CONSTANTS.app_id
         # print('to_jwt:', data)
@@ -132,60 +226,58 @@ class JwtObject(Generic[AL], metaclass=JwtObjectMeta):
 
     @staticmethod
     def from_any_jwt(jwt_str: str, subject: Union[str, int, None]) -> 'JwtObject':
-        try:
-            payload = jwt.decode(jwt=jwt_str, key=CONSTANTS.key, algorithms='HS256')
-        except jwt.DecodeError:
-            print('invalid jwt')
-            raise
+        payload = _decode_verified(jwt_str)
         # print('jwt payload:', payload)
 
         # check data type
         payload_data_type = payload.get('__type__', None)
         if payload_data_type == None:
             msg = f'Missing jwt type'
-            print('invalid jwt object:', msg)
+            logger.info('Invalid jwt object: %s', msg)
             raise JwtObjectDecodeError(msg)
-        return jwt_type_map[payload_data_type].from_jwt(jwt_str, subject=subject)
+        return jwt_type_map[payload_data_type]._from_payload(payload, subject=subject)
 
     @classmethod
     def from_jwt(cls: Type[TJwt],
                  jwt_str: str,
                  subject: Union[str, int, None],
                  minimum_access_level: AccessLevels = AccessLevels.min) -> TJwt:
-        try:
-            payload = jwt.decode(jwt=jwt_str, key=CONSTANTS.key, algorithms='HS256')
-        except jwt.DecodeError:
-            print('invalid jwt')
-            raise
+        payload = _decode_verified(jwt_str)
         # print('jwt payload:', payload)
+        return cls._from_payload(payload, subject=subject, minimum_access_level=minimum_access_level)
 
+    @classmethod
+    def _from_payload(cls: Type[TJwt],
+                      payload: Dict[str, Any],
+                      subject: Union[str, int, None],
+                      minimum_access_level: AccessLevels = AccessLevels.min) -> TJwt:
         # check data type
         payload_data_type = payload.get('__type__', None)
         if payload_data_type != cls.__type__:
             msg = f'Not the expected data type. expected {cls.__type__}, got {payload_data_type}'
-            print('invalid jwt object:', msg)
+            logger.info('Invalid jwt object: %s', msg)
             raise JwtObjectDecodeError(msg)
 
         # check access level
         payload_access_level = payload.get('__access_level__', None)
         if payload_access_level is None:
             msg = 'Missing access_level field'
-            print('invalid jwt object:', msg)
+            logger.info('Invalid jwt object: %s', msg)
             raise JwtObjectDecodeError(msg)
         if not isinstance(payload_access_level, int):
             msg = f'access_level field is not an int, is {type(payload_access_level)}'
-            print('invalid jwt object:', msg)
+            logger.info('Invalid jwt object: %s', msg)
             raise JwtObjectDecodeError(msg)
         if payload_access_level < minimum_access_level.value:
             msg = f'Access denied. Minimum access level: {minimum_access_level}, got {payload_access_level}'
-            print('insufficient access for jwt object:', msg)
+            logger.info('Insufficient access for jwt object: %s', msg)
             raise JwtObjectAccessLevelError(msg)
 
         # check subject
         sub = payload.get('sub', None)  # subject (the one that can use the token)
         if subject is not None and sub != subject:
             msg = 'Subject is not valid'
-            print('invalid jwt object:', msg)
+            logger.info('Invalid jwt object: %s', msg)
             raise JwtObjectDecodeError(msg)
 
         payload.pop('sub')  # subject (the one that can use the token)
@@ -197,11 +289,9 @@ class JwtObject(Generic[AL], metaclass=JwtObjectMeta):
         return cls(subject=sub, access_level=AccessLevels(payload_access_level), **payload)
 
     def downgrade_access(self, access_level: AccessLevels):
-        for field_name, field_type in self.__annotations__.items():
-            if is_subclass(field_type, AccessLevel):
-                if access_level.value < field_type.level:
-                    if hasattr(self, field_name):
-                        delattr(self, field_name)
+        for field_name in type(self).field_plan(access_level.value).hidden:
+            if field_name in self.__dict__:
+                delattr(self, field_name)
         self.__access_level__ = access_level.value
 
     def __eq__(self, other: Union[dict, 'JwtObject']):
@@ -216,16 +306,6 @@ class JwtObject(Generic[AL], metaclass=JwtObjectMeta):
         return f'{type(self).__name__}[{AccessLevels(self.__access_level__).name}]({str(self.to_dict(human_readable=True))})'
 
 
-def is_subclass(variable_type: Type, expected_type: Union[Type, Tuple[Type, ...]]) -> bool:
-    if hasattr(variable_type, '__origin__'):
-        return is_subclass(variable_type.__origin__, expected_type)  # type: ignore
-    else:
-        try:
-            return issubclass(variable_type, expected_type)
-        except:
-            return False
-
-
 def is_type(value: Any, variable_type: Type, subject: Union[str, int, None]) -> Tuple[bool, Any]:
     if is_subclass(variable_type, AccessLevel):
         if len(variable_type.__args__) != 1:  # type: ignore
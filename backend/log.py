@@ -0,0 +1,78 @@
+'''Application logging. Records go through a queue to a background thread, so request threads never block on
+the output stream. Expensive messages are wrapped in Lazy, which is only formatted when the record passes the
+level and the sampling of its endpoint'''
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from typing import Any, Callable, Optional
+
+import flask
+
+from backend.constants import CONSTANTS
+
+logger = logging.getLogger('backend')
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class Lazy:
+    '''A log argument computed only if the record is emitted'''
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func: Callable[..., Any], *args: Any):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+
+def request_sampled() -> bool:
+    '''Whether the debug and info records of the current request are kept, decided once per request from
+    the sample rate of its endpoint. Outside of requests everything is kept'''
+    if not flask.has_request_context():
+        return True
+    # flask.g may be shared by several requests of one app context, the decision is kept with its request
+    request = flask.request._get_current_object()
+    sampled = flask.g.get('log_sampled', None)
+    if sampled is None or sampled[0] is not request:
+        rate = CONSTANTS.log_sample_rates.get(flask.request.endpoint, CONSTANTS.log_sample_rate)
+        sampled = flask.g.log_sampled = (request, rate >= 1 or random.random() < rate)
+    return sampled[1]
+
+
+class EndpointSampler(logging.Filter):
+    '''Drops the debug and info records of requests left out by sampling. Warnings and errors are always kept'''
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or request_sampled()
+
+
+def setup(level: str = CONSTANTS.log_level):
+    '''Sends the backend records through a queue to a background thread writing to stdout'''
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    records: 'queue.SimpleQueue[logging.LogRecord]' = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, output)
+
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(EndpointSampler())
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    '''A child of the backend logger, e.g. get_logger(__name__)'''
+    if name == 'backend' or name.startswith('backend.'):
+        return logging.getLogger(name)
+    return logger.getChild(name)
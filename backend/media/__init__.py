@@ -0,0 +1,14 @@
+from backend.media.decoding import decode_frame, decode_frames
+from backend.media.encoding import VideoFrameWriter, encode_spooled_frames, recover_stale_jobs, submit_encoding_job
+from backend.media.responses import content_tag, media_etag, revalidate, send_media
+from backend.media.signing import media_folder, sign_media_url, verify_media_signature
+from backend.media.ingest import UnsupportedUploadFormat, iter_request_frames
+from backend.media.spool import (
+    FRAME_STREAM_MIMETYPE,
+    FrameSpoolWriter,
+    SpooledFrame,
+    iter_frame_stream,
+    iter_spooled_frames,
+    read_spool_index,
+    write_spool_chunk,
+)
@@ -0,0 +1,55 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import itertools
+from typing import Deque, Iterable, Iterator, List, Optional
+
+import cv2
+import numpy as np
+
+
+def decode_frame(img_data: bytes) -> np.ndarray:
+    nparr = np.frombuffer(img_data, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError('Frame could not be decoded')
+    return img
+
+
+def _decode_batch(batch: List[bytes]) -> List[np.ndarray]:
+    return [decode_frame(img_data) for img_data in batch]
+
+
+def _batched(frames: Iterable[bytes], batch_size: int) -> Iterator[List[bytes]]:
+    iterator = iter(frames)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def decode_frames(frames: Iterable[bytes],
+                  workers: int,
+                  batch_size: int,
+                  max_in_flight: Optional[int] = None) -> Iterator[np.ndarray]:
+    '''Decodes frames in batches across a pool of workers, yielding them in their original order.
+    At most max_in_flight batches are pending at once, so memory stays flat however many frames there are.
+
+    cv2.imdecode releases the GIL, so threads decode in parallel without
+    pickling every decoded frame back from another process'''
+    if workers <= 1:
+        yield from map(decode_frame, frames)
+        return
+
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending: Deque[Future] = deque()
+        for batch in _batched(frames, batch_size):
+            pending.append(pool.submit(_decode_batch, batch))
+            if len(pending) >= max_in_flight:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
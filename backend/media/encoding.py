@@ -0,0 +1,264 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import datetime
+import functools
+import multiprocessing
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import sqlalchemy
+
+from backend import database as db
+from backend import helper_functions
+from backend import log
+from backend.constants import CONSTANTS
+from backend.media import storage
+from backend.media.decoding import decode_frames
+from backend.media.spool import SpooledFrame, iter_spooled_frames, read_spool_index
+
+logger = log.get_logger(__name__)
+
+
+class VideoFrameWriter:
+    '''Appends decoded frames to a video file.
+    The underlying VideoWriter is opened with the size of the first frame'''
+    def __init__(self, path: str, fps: float = 30, fourcc: str = 'VP09'):
+        self.path = path
+        self.fps = fps
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self._writer: Optional[cv2.VideoWriter] = None
+
+    def write_image(self, img: np.ndarray):
+        if self._writer is None:
+            height, width, channels = img.shape
+            self._writer = cv2.VideoWriter(self.path, self.fourcc, self.fps, (width, height))
+
+        self._writer.write(img)
+
+    def release(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def estimate_fps(frames: List[SpooledFrame], default: float = 30) -> float:
+    '''Uses the capture timestamps, when every frame has one, to find the frame rate of the recording'''
+    if len(frames) < 2 or any(frame.timestamp is None for frame in frames):
+        return default
+
+    duration = (frames[-1].timestamp - frames[0].timestamp) / 1000  # type: ignore
+    if duration <= 0:
+        return default
+    return (len(frames) - 1) / duration
+
+
+def encode_spooled_frames(spool_path: str) -> Tuple[str, str]:
+    '''Encodes the frames of a spool file into a video, using the first frame as thumbnail.
+    Returns the stored video and thumbnail paths'''
+    spooled_frames = read_spool_index(spool_path)
+    if not spooled_frames:
+        raise ValueError('Thumb cannot be none. Are there any frames?')
+
+    video_path = storage.temp_path(CONSTANTS.video_folder, '.mp4')
+    try:
+        with VideoFrameWriter(video_path, fps=estimate_fps(spooled_frames)) as writer:
+            frames = iter_spooled_frames(spool_path, spooled_frames)
+            for img in decode_frames(frames, workers=CONSTANTS.decode_workers, batch_size=CONSTANTS.decode_batch_size):
+                writer.write_image(img)
+
+        thumb = next(iter_spooled_frames(spool_path, spooled_frames[:1]))
+        video_filename = storage.store_file(video_path, CONSTANTS.video_folder, '.mp4')
+    except:
+        if os.path.isfile(video_path):
+            os.remove(video_path)
+        raise
+
+    thumb_filename = storage.store_bytes(thumb, CONSTANTS.thumbnail_folder, '.png')
+    return video_filename, thumb_filename
+
+
+# encoding jobs run in worker processes, which have no flask app.
+# They talk to the database through a plain engine instead
+_engines: Dict[str, sqlalchemy.engine.Engine] = {}
+
+
+def _get_engine(database_uri: str) -> sqlalchemy.engine.Engine:
+    if database_uri not in _engines:
+        _engines[database_uri] = sqlalchemy.create_engine(database_uri, pool_pre_ping=True)
+    return _engines[database_uri]
+
+
+def run_encoding_job(database_uri: str, job_id: int):
+    '''Encodes the spooled frames of an EncodingJob and, once done, inserts its VideoInfo'''
+    jobs = db.EncodingJob.__table__
+    videos = db.VideoInfo.__table__
+    engine = _get_engine(database_uri)
+    with engine.begin() as conn:
+        job = conn.execute(sqlalchemy.select(jobs).where(jobs.c.id == job_id)).one()
+        # a job resubmitted by recover_stale_jobs may reach the workers twice, only the first run claims it
+        q = jobs.update().where(jobs.c.id == job_id).where(jobs.c.status == db.EncodingJobStatus.queued)
+        claimed = conn.execute(q.values(status=db.EncodingJobStatus.encoding,
+                                        updated=helper_functions.datetime_now())).rowcount
+    if not claimed:
+        return
+
+    try:
+        video_filename, thumb_filename = encode_spooled_frames(job.spool_path)
+        with engine.begin() as conn:
+            result = conn.execute(videos.insert().values(video_path=video_filename,
+                                                         thumbnail_path=thumb_filename,
+                                                         date=job.date,
+                                                         patient_id=job.patient_id))
+            video_id = result.inserted_primary_key[0]
+            conn.execute(jobs.update().where(jobs.c.id == job_id).values(status=db.EncodingJobStatus.done,
+                                                                          video_id=video_id,
+                                                                          updated=helper_functions.datetime_now()))
+    except Exception as ex:
+        logger.exception('Encoding job %s failed', job_id)
+        _mark_failed(database_uri, job_id, repr(ex))
+        return
+
+    os.remove(job.spool_path)
+
+
+def _mark_failed(database_uri: str, job_id: int, error: str):
+    '''Fails a job that has not finished, so its spool is left to the sweeper'''
+    jobs = db.EncodingJob.__table__
+    q = jobs.update().where(jobs.c.id == job_id)
+    q = q.where(jobs.c.status.in_([db.EncodingJobStatus.queued, db.EncodingJobStatus.encoding]))
+    with _get_engine(database_uri).begin() as conn:
+        conn.execute(q.values(status=db.EncodingJobStatus.failed, error=error[:512], updated=helper_functions.datetime_now()))
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn instead of fork: forking a multithreaded gunicorn worker is not safe
+            _executor = ProcessPoolExecutor(max_workers=CONSTANTS.encoding_workers,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    '''Drops a broken pool, the next get_executor starts a new one'''
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+
+
+def _job_finished(database_uri: str, job_id: int, executor: ProcessPoolExecutor, future: Future):
+    if future.cancelled():
+        return
+    exception = future.exception()
+    if exception is None:
+        return
+    if not isinstance(exception, BrokenProcessPool):
+        # run_encoding_job fails the job itself, except when the database is unreachable.
+        # The job stays queued until recover_stale_jobs picks it up
+        logger.error('Encoding job %s could not run: %r', job_id, exception)
+        return
+
+    # a worker died, maybe on another job, and took every job of the pool with it.
+    # Jobs that had not started yet are sent to a new pool, the one being encoded is failed
+    logger.error('Encoding pool broken while running job %s', job_id)
+    _discard_executor(executor)
+    try:
+        jobs = db.EncodingJob.__table__
+        with _get_engine(database_uri).begin() as conn:
+            status = conn.execute(sqlalchemy.select(jobs.c.status).where(jobs.c.id == job_id)).scalar()
+        if status == db.EncodingJobStatus.queued:
+            submit_encoding_job(database_uri, job_id)
+        elif status == db.EncodingJobStatus.encoding:
+            _mark_failed(database_uri, job_id, 'Encoding worker crashed')
+    except Exception:
+        logger.exception('Could not recover encoding job %s', job_id)
+
+
+def submit_encoding_job(database_uri: str, job_id: int) -> Optional[Future]:
+    '''Sends a job to the encoding pool, replacing the pool if it is broken.
+    A job that cannot be submitted is marked failed and None is returned'''
+    for _ in range(2):
+        try:
+            executor = get_executor()
+            future = executor.submit(run_encoding_job, database_uri, job_id)
+        except BrokenProcessPool:
+            logger.warning('Encoding pool broken, starting a new one')
+            _discard_executor(executor)
+            continue
+        except Exception as ex:
+            logger.exception('Could not submit encoding job %s', job_id)
+            _mark_failed(database_uri, job_id, repr(ex))
+            return None
+        future.add_done_callback(functools.partial(_job_finished, database_uri, job_id, executor))
+        return future
+
+    _mark_failed(database_uri, job_id, 'Encoding pool unavailable')
+    return None
+
+
+def recover_stale_jobs(database_uri: str, timeout: float = CONSTANTS.encoding_job_timeout) -> Tuple[int, int]:
+    '''Jobs of a worker that was restarted are lost with its pool. Those queued for longer than timeout seconds are
+    resubmitted and those encoding for that long are failed, so the sweeper can remove their spools.
+    Returns how many were resubmitted and failed'''
+    jobs = db.EncodingJob.__table__
+    engine = _get_engine(database_uri)
+    now = helper_functions.datetime_now()
+    stale = sqlalchemy.or_(jobs.c.updated.is_(None), jobs.c.updated < now - datetime.timedelta(seconds=timeout))
+
+    with engine.begin() as conn:
+        q = jobs.update().where(jobs.c.status == db.EncodingJobStatus.encoding).where(stale)
+        failed = conn.execute(q.values(status=db.EncodingJobStatus.failed,
+                                       error='Encoding did not finish in time',
+                                       updated=now)).rowcount
+        q = sqlalchemy.select(jobs.c.id).where(jobs.c.status == db.EncodingJobStatus.queued).where(stale)
+        queued_ids = [job_id for (job_id, ) in conn.execute(q)]
+
+    resubmitted = 0
+    for job_id in queued_ids:
+        # touching the job claims it, so workers recovering at the same time submit it only once
+        with engine.begin() as conn:
+            q = jobs.update().where(jobs.c.id == job_id).where(jobs.c.status == db.EncodingJobStatus.queued).where(stale)
+            if not conn.execute(q.values(updated=now)).rowcount:
+                continue
+        if submit_encoding_job(database_uri, job_id) is not None:
+            resubmitted += 1
+
+    if resubmitted or failed:
+        logger.warning('Recovered stale encoding jobs: %s resubmitted, %s failed', resubmitted, failed)
+    return resubmitted, failed
+
+
+def start_job_recovery(app, interval: float) -> threading.Thread:
+    '''Runs recover_stale_jobs at startup and then every interval seconds in a daemon thread'''
+    database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+
+    def run():
+        while True:
+            try:
+                recover_stale_jobs(database_uri)
+            except sqlalchemy.exc.DatabaseError as ex:
+                # e.g. scripts that create the application before the tables
+                logger.warning('Encoding job recovery failed: %s', ex.orig)
+            except Exception:
+                logger.exception('Encoding job recovery failed')
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='encoding-job-recovery', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,95 @@
+import base64
+from typing import Callable, IO, Iterator, Optional, Tuple
+from urllib.parse import unquote_to_bytes
+
+import flask
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+from backend.media.spool import FRAME_STREAM_MIMETYPE, iter_frame_stream
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UnsupportedUploadFormat(Exception):
+    pass
+
+
+def _is_frame_field(name: str) -> bool:
+    return name.startswith('frame')
+
+
+def _iter_multipart_fields(stream: IO[bytes], boundary: bytes,
+                           wanted: Callable[[str], bool]) -> Iterator[Tuple[str, bytes]]:
+    '''Incrementally parses a multipart/form-data body, yielding each wanted part as soon as it is complete.
+    Only the part being received is kept in memory'''
+    decoder = MultipartDecoder(boundary)
+    name = None
+    value = bytearray()
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, (Field, File)):
+                name = event.name if wanted(event.name) else None
+                value = bytearray()
+            elif isinstance(event, Data) and name is not None:
+                value += event.data
+                if not event.more_data:
+                    yield name, bytes(value)
+                    name = None
+                    value = bytearray()
+            event = decoder.next_event()
+
+        if isinstance(event, Epilogue) or not chunk:
+            return
+
+
+def _iter_urlencoded_fields(stream: IO[bytes], wanted: Callable[[str], bool]) -> Iterator[Tuple[str, bytes]]:
+    '''Incrementally parses an application/x-www-form-urlencoded body, yielding each wanted field as soon as
+    its separator arrives'''
+    def decode(pair: bytes):
+        raw_name, _, raw_value = pair.partition(b'=')
+        name = unquote_to_bytes(raw_name.replace(b'+', b' ')).decode()
+        if wanted(name):
+            return name, unquote_to_bytes(raw_value.replace(b'+', b' '))
+        return None
+
+    pending = b''
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        pairs = (pending + chunk).split(b'&')
+        pending = pairs.pop()
+        for pair in pairs:
+            field = decode(pair)
+            if field is not None:
+                yield field
+
+    if pending:
+        field = decode(pending)
+        if field is not None:
+            yield field
+
+
+def iter_request_frames(request: flask.Request) -> Iterator[Tuple[Optional[int], Optional[float], bytes]]:
+    '''Yields (index, capture timestamp, encoded image) for every frame in the request body, in arrival order,
+    without buffering the whole body.
+
+    Legacy form uploads carry base64 frame* fields with neither index nor timestamp,
+    binary uploads use the frame stream format'''
+    if request.mimetype == FRAME_STREAM_MIMETYPE:
+        yield from iter_frame_stream(request.stream)
+        return
+
+    if request.mimetype == 'multipart/form-data':
+        boundary = request.mimetype_params.get('boundary', '').encode()
+        fields = _iter_multipart_fields(request.stream, boundary, wanted=_is_frame_field)
+    elif request.mimetype == 'application/x-www-form-urlencoded':
+        fields = _iter_urlencoded_fields(request.stream, wanted=_is_frame_field)
+    else:
+        raise UnsupportedUploadFormat(f'Unsupported upload content type: {request.mimetype}')
+
+    for _, value in fields:
+        yield None, None, base64.b64decode(value)
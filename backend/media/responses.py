@@ -0,0 +1,157 @@
+import hashlib
+import hmac
+import mimetypes
+import os
+from http import HTTPStatus
+from typing import IO, Iterator, Optional, Tuple
+from urllib.parse import quote
+
+import flask
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+from backend.constants import CONSTANTS
+from backend.media import storage
+
+CHUNK_SIZE = 64 * 1024
+
+
+def content_tag(relative_path: str, path: str) -> str:
+    '''Identifies the content of a stored file. Content-addressed files carry their hash in the name,
+    files from the old flat layout fall back to size and modification time'''
+    if storage.is_sharded(relative_path):
+        return os.path.splitext(os.path.basename(relative_path))[0]
+    stat = os.stat(path)
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+def _mac(kind: str, subject: int, video_id: int, content_tag: str) -> str:
+    message = f'{kind}:{subject}:{video_id}:{content_tag}'.encode()
+    return hmac.new(CONSTANTS.key.encode(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def media_etag(kind: str, subject: int, video_id: int, relative_path: str, path: str) -> str:
+    '''A strong etag for a stored file, signed for the user it was served to'''
+    tag = content_tag(relative_path, path)
+    return f'{video_id}.{tag}.{_mac(kind, subject, video_id, tag)}'
+
+
+def _not_modified(etag: str, cache_control: str = 'private, no-cache') -> flask.Response:
+    response = flask.Response(status=HTTPStatus.NOT_MODIFIED)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def revalidate(kind: str, subject: int, video_id: int) -> Optional[flask.Response]:
+    '''Answers 304 Not Modified without touching the database when If-None-Match carries an etag
+    that was issued to this same user for this same media. Stored files never change, and the etag
+    could only have been obtained after passing the access check, so the client may keep its copy'''
+    for etag in flask.request.if_none_match.as_set():
+        parts = etag.split('.')
+        if len(parts) != 3 or parts[0] != str(video_id):
+            continue
+        _, content_tag, mac = parts
+        # as bytes: compare_digest rejects non-ascii str, and the etag may hold anything
+        if hmac.compare_digest(mac.encode(), _mac(kind, subject, video_id, content_tag).encode()):
+            return _not_modified(etag)
+    return None
+
+
+def _iter_file_range(f: IO[bytes], start: int, length: int) -> Iterator[bytes]:
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _requested_range(etag: str, last_modified: float, size: int) -> Optional[Tuple[int, int]]:
+    '''The (start, stop) of a single satisfiable byte range, or None to send the whole file.
+    Raises ValueError for unsatisfiable ranges'''
+    request = flask.request
+    if request.range is None or request.range.units != 'bytes' or len(request.range.ranges) != 1:
+        return None
+
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None and if_range.date.timestamp() < int(last_modified):
+        return None
+
+    byte_range = request.range.range_for_length(size)
+    if byte_range is None:
+        raise ValueError('Range not satisfiable')
+    return byte_range
+
+
+def _offload(folder: str, relative_path: str, path: str, mimetype: str) -> flask.Response:
+    '''An empty response telling the front proxy which file to send. The proxy handles ranges itself'''
+    response = flask.Response(mimetype=mimetype)
+    if CONSTANTS.media_offload == 'x-accel-redirect':
+        location = CONSTANTS.media_offload_locations[folder]
+        response.headers['X-Accel-Redirect'] = location.rstrip('/') + '/' + quote(relative_path)
+    elif CONSTANTS.media_offload == 'x-sendfile':
+        response.headers['X-Sendfile'] = path
+    else:
+        raise ValueError(f'Unknown media offload mode: {CONSTANTS.media_offload}')
+    return response
+
+
+def send_media(folder: str, relative_path: str, etag: str, cache_control: str = 'private, no-cache') -> flask.Response:
+    '''Sends a stored file with explicit conditional and byte range handling:
+    304 for If-None-Match/If-Modified-Since, 206 with Content-Range for a single range, 416 for unsatisfiable ones.
+    With CONSTANTS.media_offload set, the bytes are left for the front proxy to send'''
+    path = safe_join(os.path.abspath(folder), relative_path)
+    if path is None or not os.path.isfile(path):
+        flask.abort(HTTPStatus.NOT_FOUND)
+
+    request = flask.request
+    stat = os.stat(path)
+    size = stat.st_size
+    last_modified = stat.st_mtime
+
+    if request.if_none_match:
+        if request.if_none_match.contains(etag):
+            return _not_modified(etag, cache_control)
+    elif request.if_modified_since is not None and int(last_modified) <= request.if_modified_since.timestamp():
+        return _not_modified(etag, cache_control)
+
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if CONSTANTS.media_offload:
+        response = _offload(folder, relative_path, path, mimetype)
+        response.headers['Cache-Control'] = cache_control
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
+
+    try:
+        byte_range = _requested_range(etag, last_modified, size)
+    except ValueError:
+        response = flask.Response(status=HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        response.headers['Content-Range'] = f'bytes */{size}'
+        return response
+
+    f = open(path, 'rb')
+    if byte_range is None:
+        response = flask.Response(wrap_file(request.environ, f, CHUNK_SIZE), mimetype=mimetype, direct_passthrough=True)
+        response.content_length = size
+    else:
+        start, stop = byte_range
+        response = flask.Response(_iter_file_range(f, start, stop - start),
+                                  status=HTTPStatus.PARTIAL_CONTENT,
+                                  mimetype=mimetype,
+                                  direct_passthrough=True)
+        response.content_length = stop - start
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Cache-Control'] = cache_control
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
@@ -0,0 +1,38 @@
+import hashlib
+import hmac
+import time
+from typing import Optional
+from urllib.parse import quote, urlencode
+
+from backend.constants import CONSTANTS
+
+# route of the SignedMedia resource
+MEDIA_ROUTE = '/api/v1/media'
+
+
+def media_folder(kind: str) -> Optional[str]:
+    return {'video': CONSTANTS.video_folder, 'thumbnail': CONSTANTS.thumbnail_folder}.get(kind, None)
+
+
+def _signature(kind: str, relative_path: str, expires: int) -> str:
+    message = f'{kind}:{relative_path}:{expires}'.encode()
+    return hmac.new(CONSTANTS.key.encode(), message, hashlib.sha256).hexdigest()
+
+
+def sign_media_url(kind: str, relative_path: str, now: Optional[float] = None) -> str:
+    '''A URL that grants access to one stored file until it expires, checked without any database access.
+    Expiration is rounded up to a multiple of the ttl, so the same URL is minted for the whole window
+    and browsers can cache what it points to'''
+    if now is None:
+        now = time.time()
+    ttl = CONSTANTS.media_url_ttl
+    expires = (int(now) // ttl + 2) * ttl
+    query = urlencode({'expires': expires, 'signature': _signature(kind, relative_path, expires)})
+    return f'{MEDIA_ROUTE}/{kind}/{quote(relative_path)}?{query}'
+
+
+def verify_media_signature(kind: str, relative_path: str, expires: int, signature: str) -> bool:
+    if expires < time.time():
+        return False
+    # as bytes: compare_digest rejects non-ascii str, and the signature comes from the url
+    return hmac.compare_digest(signature.encode(), _signature(kind, relative_path, expires).encode())
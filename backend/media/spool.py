@@ -0,0 +1,108 @@
+import math
+import os
+import struct
+from typing import IO, Iterator, List, NamedTuple, Optional, Tuple
+
+FRAME_STREAM_MIMETYPE = 'application/x-frame-stream'
+
+# frame index (uint32), capture timestamp in milliseconds (float64, NaN when unknown), data length (uint32)
+_header = struct.Struct('>IdI')
+
+
+class SpooledFrame(NamedTuple):
+    index: int
+    timestamp: Optional[float]
+    offset: int
+    length: int
+
+
+def _read_header(f: IO[bytes]):
+    header = f.read(_header.size)
+    if not header:
+        return None
+    if len(header) < _header.size:
+        raise ValueError('Truncated frame header')
+
+    index, timestamp, length = _header.unpack(header)
+    return index, (None if math.isnan(timestamp) else timestamp), length
+
+
+def iter_frame_stream(f: IO[bytes]) -> Iterator[Tuple[int, Optional[float], bytes]]:
+    '''Parses a frame stream (the application/x-frame-stream upload format, also used for spool files)
+    one record at a time, yielding (index, timestamp, data)'''
+    while True:
+        header = _read_header(f)
+        if header is None:
+            return
+        index, timestamp, length = header
+        img_data = f.read(length)
+        if len(img_data) < length:
+            raise ValueError(f'Truncated frame {index}')
+        yield index, timestamp, img_data
+
+
+class FrameSpoolWriter:
+    '''Appends encoded frames to a spool file in the frame stream format'''
+    def __init__(self, path: str):
+        self.path = path
+        self.frame_count = 0
+        self._file = open(path, 'wb')
+
+    def write(self, img_data: bytes, index: Optional[int] = None, timestamp: Optional[float] = None):
+        if index is None:
+            index = self.frame_count
+        self._file.write(_header.pack(index, math.nan if timestamp is None else timestamp, len(img_data)))
+        self._file.write(img_data)
+        self.frame_count += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_spool_chunk(path: str, offset: int, stream: IO[bytes], chunk_size: int = 64 * 1024) -> int:
+    '''Writes the bytes read from stream into the spool file starting at offset, which must not be past its end.
+    Writing the same chunk again is harmless. Returns the new spool size'''
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            f.write(chunk)
+        f.seek(0, os.SEEK_END)
+        return f.tell()
+
+
+def read_spool_index(path: str) -> List[SpooledFrame]:
+    '''Scans the record headers of a spool file, returning them sorted by frame index'''
+    frames: List[SpooledFrame] = []
+    with open(path, 'rb') as f:
+        while True:
+            header = _read_header(f)
+            if header is None:
+                break
+            index, timestamp, length = header
+            frames.append(SpooledFrame(index, timestamp, f.tell(), length))
+            f.seek(length, 1)
+
+        if frames and frames[-1].offset + frames[-1].length > os.fstat(f.fileno()).st_size:
+            raise ValueError(f'Truncated frame {frames[-1].index}')
+
+    frames.sort(key=lambda frame: frame.index)
+    return frames
+
+
+def iter_spooled_frames(path: str, frames: Optional[List[SpooledFrame]] = None) -> Iterator[bytes]:
+    '''Yields the frames of a spool file one at a time, in frame index order'''
+    if frames is None:
+        frames = read_spool_index(path)
+    with open(path, 'rb') as f:
+        for frame in frames:
+            f.seek(frame.offset)
+            yield f.read(frame.length)
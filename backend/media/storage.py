@@ -0,0 +1,87 @@
+import hashlib
+import os
+import shutil
+import uuid
+from typing import Callable, Tuple
+
+TEMP_FOLDER = '.tmp'
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def temp_path(folder: str, extension: str) -> str:
+    '''A path in folder's temp area, on the same filesystem as the final location so it can be renamed there'''
+    temp_folder = os.path.join(folder, TEMP_FOLDER)
+    os.makedirs(temp_folder, exist_ok=True)
+    return os.path.join(temp_folder, str(uuid.uuid4()) + extension)
+
+
+def _content_path(digest: str, extension: str) -> str:
+    '''The content-addressed path, relative to the storage folder, sharded into two levels of subdirectories'''
+    return f'{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def _publish(src_path: str, dst_path: str, keep_src: bool = False):
+    '''Atomically makes src_path visible as dst_path. A content-addressed dst_path that already exists holds the
+    same bytes and is reused, rows sharing a file are fine since the sweeper only removes unreferenced ones.
+    src_path is removed, unless keep_src'''
+    try:
+        os.link(src_path, dst_path)
+    except FileExistsError:
+        pass
+    except OSError:
+        # filesystems without hard links. Replacing an existing dst_path with identical bytes is harmless
+        if keep_src:
+            copy_path = f'{dst_path}.{uuid.uuid4()}.copy'
+            shutil.copyfile(src_path, copy_path)
+            os.replace(copy_path, dst_path)
+        else:
+            os.replace(src_path, dst_path)
+
+    # a link keeps the mtime of src_path and a reused file may be old. Until the row referring to dst_path is
+    # committed nothing references it, a fresh mtime keeps it inside the sweeper's grace period meanwhile
+    os.utime(dst_path)
+    if not keep_src and os.path.exists(src_path):
+        os.remove(src_path)
+
+
+def store_file(src_path: str, folder: str, extension: str) -> str:
+    '''Moves a finished file into folder under its content-addressed name, or drops it if identical content is
+    already stored. src_path should come from temp_path(folder, ...). Returns the stored path, relative to folder'''
+    relative_path = _content_path(hash_file(src_path), extension)
+    dst_path = os.path.join(folder, relative_path)
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    _publish(src_path, dst_path)
+    return relative_path
+
+
+def store_bytes(data: bytes, folder: str, extension: str) -> str:
+    path = temp_path(folder, extension)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return store_file(path, folder, extension)
+
+
+def is_sharded(relative_path: str) -> bool:
+    return '/' in relative_path
+
+
+def migrate_flat_file(folder: str, relative_path: str) -> Tuple[str, Callable[[], None]]:
+    '''Links a file from the old flat layout into the sharded layout.
+    Returns the new relative path and a function that removes the old file,
+    to be called once the database points to the new path'''
+    src_path = os.path.join(folder, relative_path)
+    new_relative_path = _content_path(hash_file(src_path), os.path.splitext(relative_path)[1])
+    dst_path = os.path.join(folder, new_relative_path)
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    _publish(src_path, dst_path, keep_src=True)
+    return new_relative_path, lambda: os.remove(src_path)
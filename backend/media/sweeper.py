@@ -0,0 +1,135 @@
+import itertools
+import os
+import threading
+import time
+from typing import IO, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+from backend import database as db
+from backend import log
+from backend.constants import CONSTANTS
+
+logger = log.get_logger(__name__)
+
+
+class SweepResult(NamedTuple):
+    files_removed: int
+    bytes_reclaimed: int
+
+
+def _iter_old_files(folder: str, older_than: float) -> Iterator[Tuple[str, str, int]]:
+    '''Yields (path relative to folder, full path, size) of every file last modified before older_than'''
+    for root, _, filenames in os.walk(folder):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime < older_than:
+                yield os.path.relpath(path, folder).replace(os.sep, '/'), path, stat.st_size
+
+
+def _batched(iterable: Iterable, batch_size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _remove(files: Iterable[Tuple[str, str, int]], dry_run: bool) -> SweepResult:
+    files_removed = 0
+    bytes_reclaimed = 0
+    for relative_path, path, size in files:
+        if not dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+        files_removed += 1
+        bytes_reclaimed += size
+    return SweepResult(files_removed, bytes_reclaimed)
+
+
+def _sweep_media_folder(folder: str, column, older_than: float, batch_size: int, dry_run: bool) -> SweepResult:
+    files_removed = 0
+    bytes_reclaimed = 0
+    for batch in _batched(_iter_old_files(folder, older_than), batch_size):
+        paths = [relative_path for relative_path, _, _ in batch]
+        referenced: Set[str] = {path for (path, ) in db.db.session.query(column).filter(column.in_(paths))}
+        result = _remove((file for file in batch if file[0] not in referenced), dry_run)
+        files_removed += result.files_removed
+        bytes_reclaimed += result.bytes_reclaimed
+    return SweepResult(files_removed, bytes_reclaimed)
+
+
+def _sweep_spool_folder(older_than: float, dry_run: bool) -> SweepResult:
+    '''Spools are kept while their encoding job is pending. Unfinalized upload sessions
+    whose spool was not written to during the grace period are considered abandoned'''
+    q = db.db.session.query(db.EncodingJob.spool_path)
+    q = q.filter(db.EncodingJob.status.in_([db.EncodingJobStatus.queued, db.EncodingJobStatus.encoding]))
+    pending = {os.path.normpath(path) for (path, ) in q}
+    old_files = _iter_old_files(CONSTANTS.spool_folder, older_than)
+    return _remove((file for file in old_files if os.path.normpath(file[1]) not in pending), dry_run)
+
+
+def sweep_orphans(grace_period: float = CONSTANTS.gc_grace_period,
+                  batch_size: int = 500,
+                  dry_run: bool = False) -> SweepResult:
+    '''Removes video, thumbnail and spool files that nothing in the database refers to anymore.
+    Only files older than grace_period seconds are considered, so uploads still being written are left alone.
+    Must run inside an app context'''
+    older_than = time.time() - grace_period
+    results = [
+        _sweep_media_folder(CONSTANTS.video_folder, db.VideoInfo.video_path, older_than, batch_size, dry_run),
+        _sweep_media_folder(CONSTANTS.thumbnail_folder, db.VideoInfo.thumbnail_path, older_than, batch_size, dry_run),
+        _sweep_spool_folder(older_than, dry_run),
+    ]
+    db.db.session.remove()
+    return SweepResult(sum(r.files_removed for r in results), sum(r.bytes_reclaimed for r in results))
+
+
+_lock_file: Optional[IO] = None
+
+
+def _hold_sweeper_lock(path: str) -> bool:
+    '''Whether this process is the one sweeping. The first worker to lock the file keeps it until it exits,
+    then another one takes over at its next interval'''
+    global _lock_file
+    if _lock_file is not None or fcntl is None:
+        return True
+    f = open(path, 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _lock_file = f
+    return True
+
+
+def start_scheduled_sweeps(app, interval: float, lock_path: str = CONSTANTS.gc_lock_path) -> threading.Thread:
+    '''Runs sweep_orphans every interval seconds in a daemon thread.
+    Every gunicorn worker starts one, but only the worker holding lock_path sweeps'''
+    def run():
+        while True:
+            time.sleep(interval)
+            if not _hold_sweeper_lock(lock_path):
+                continue
+            try:
+                with app.app_context():
+                    result = sweep_orphans()
+                logger.info('Garbage collection removed %s files, reclaiming %s bytes', result.files_removed,
+                            result.bytes_reclaimed)
+            except Exception:
+                logger.exception('Garbage collection failed')
+
+    thread = threading.Thread(target=run, name='media-sweeper', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,126 @@
+'''Per-endpoint request metrics in the Prometheus text format, served on /metrics.
+
+Every request is counted by endpoint, method and status and its latency observed. Its time is also split in
+stages: jwt decoding, parameter validation, database and the rest of the handler. Stages are exclusive, the
+time of a stage running inside another is only counted in the inner one.
+
+With several gunicorn workers, PROMETHEUS_MULTIPROC_DIR must point to a directory shared by them (see
+gunicorn.conf.py), so /metrics aggregates the samples of every worker'''
+import contextlib
+import functools
+import hmac
+from http import HTTPStatus
+import os
+import time
+from typing import Iterator
+
+import flask
+import prometheus_client
+import prometheus_client.multiprocess
+
+from backend.constants import CONSTANTS
+
+REQUESTS = prometheus_client.Counter('http_requests', 'Requests handled', ['endpoint', 'method', 'status'])
+LATENCY = prometheus_client.Histogram('http_request_duration_seconds', 'Time to handle a request',
+                                      ['endpoint', 'method'])
+STAGES = prometheus_client.Histogram('http_request_stage_duration_seconds',
+                                     'Time spent in each stage of a request', ['endpoint', 'stage'],
+                                     buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5))
+
+
+class _StageTimer:
+    '''Stage times of one request. open_stages holds, for each running stage, the time of the stages run
+    inside it, to be taken out of its own'''
+    def __init__(self):
+        self.totals = {}
+        self.open_stages = []
+
+    def add(self, name: str, elapsed: float):
+        self.totals[name] = self.totals.get(name, 0.0) + elapsed
+        if self.open_stages:
+            self.open_stages[-1] += elapsed
+
+
+def _timer():
+    if not flask.has_request_context():
+        return None
+    return flask.g.get('stage_timer', None)
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    '''Times the block as a stage of the current request. Does nothing outside of requests'''
+    timer = _timer()
+    if timer is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    timer.open_stages.append(0.0)
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        inner = timer.open_stages.pop()
+        timer.totals[name] = timer.totals.get(name, 0.0) + elapsed - inner
+        if timer.open_stages:
+            timer.open_stages[-1] += elapsed
+
+
+def timed_handler(func):
+    '''Times a resource method as the handler stage'''
+    @functools.wraps(func)
+    def timed_handler_w(*args, **kwargs):
+        with stage('handler'):
+            return func(*args, **kwargs)
+
+    return timed_handler_w
+
+
+def add_stage_time(name: str, elapsed: float):
+    '''Adds time measured elsewhere to a stage of the current request, e.g. the statements timed by
+    database.instrumentation to db. Does nothing outside of requests'''
+    timer = _timer()
+    if timer is not None:
+        timer.add(name, elapsed)
+
+
+def _start_request():
+    flask.g.stage_timer = _StageTimer()
+    flask.g.request_start = time.perf_counter()
+
+
+def _finish_request(response: flask.Response) -> flask.Response:
+    timer = flask.g.get('stage_timer', None)
+    if timer is None:
+        return response
+    endpoint = flask.request.endpoint or 'unmatched'
+    method = flask.request.method
+    REQUESTS.labels(endpoint, method, str(response.status_code)).inc()
+    LATENCY.labels(endpoint, method).observe(time.perf_counter() - flask.g.request_start)
+    for name, seconds in timer.totals.items():
+        STAGES.labels(endpoint, name).observe(seconds)
+    return response
+
+
+def _registry():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR', None):
+        registry = prometheus_client.CollectorRegistry()
+        prometheus_client.multiprocess.MultiProcessCollector(registry)
+        return registry
+    return prometheus_client.REGISTRY
+
+
+def metrics_view():
+    if CONSTANTS.metrics_token:
+        token = flask.request.headers.get('Authorization', '')
+        if not hmac.compare_digest(token.encode(), f'Bearer {CONSTANTS.metrics_token}'.encode()):
+            flask.abort(HTTPStatus.UNAUTHORIZED)
+    return flask.Response(prometheus_client.generate_latest(_registry()),
+                          content_type=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+def init_app(app: flask.Flask):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
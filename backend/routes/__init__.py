@@ -5,12 +5,14 @@ class TokenObject(TypedDict):
     token: str
 
 
-from backend.routes.video import PatientSessions, ProfessionalPatientSessions, Thumbnail, Video
+from backend.routes.video import PatientSessions, ProfessionalPatientSessions, SignedMedia, Thumbnail, Video
 import flask
 import flask_restful
 from travel_backpack.decorators import decorate_all_methods
 
 from backend import helper_functions
+from backend import metrics
+from backend import serialization
 from backend.routes.access_test import AccessTest
 
 from backend.routes.login import Login
@@ -19,17 +21,26 @@ from backend.routes.logout import Logout
 from backend.routes.signup import PatientSignup, ProfessionalSignup
 
 from backend.routes.gameconfig import GameConfig, PatientGameConfig
-from backend.routes.professional import ProfessionalLinking
-from backend.routes.patient import PatientLinking, PatientVideoInput
+from backend.routes.professional import ProfessionalDashboard, ProfessionalLinking
+from backend.routes.patient import (
+    PatientLinking,
+    PatientUploadSession,
+    PatientUploadSessionFinalize,
+    PatientUploadSessions,
+    PatientUploadStatus,
+    PatientVideoInput,
+)
 
 api = flask_restful.Api()
+api.representation('application/json')(serialization.output_json)
 
 docs = {}
 
 
 def add_resource(resource, *routes):
-    """Adds the resource and also adds the session_remove decorator
+    """Adds the resource and also adds the session_remove and metrics decorators
     """
+    resource = decorate_all_methods(metrics.timed_handler)(resource)
     session_remover_class_decorator = decorate_all_methods(helper_functions.session_remove)
     resource = session_remover_class_decorator(resource)
     api.add_resource(resource, *routes)
@@ -48,16 +59,22 @@ add_api_resource(Login, '/login')
 add_api_resource(Logout, '/logout')
 
 add_api_resource(ProfessionalLinking, '/professional/link')
+add_api_resource(ProfessionalDashboard, '/professional/dashboard')
 add_api_resource(ProfessionalPatientSessions, '/professional/sessions')
 add_api_resource(GameConfig, '/professional/patient/game-config')
 
 add_api_resource(PatientLinking, '/patient/link')
 add_api_resource(PatientSessions, '/patient/sessions')
 add_api_resource(PatientVideoInput, '/patient/upload')
+add_api_resource(PatientUploadStatus, '/patient/upload/<int:job_id>')
+add_api_resource(PatientUploadSessions, '/patient/upload/session')
+add_api_resource(PatientUploadSession, '/patient/upload/session/<int:session_id>')
+add_api_resource(PatientUploadSessionFinalize, '/patient/upload/session/<int:session_id>/finalize')
 add_api_resource(PatientGameConfig, '/patient/game-config')
 
 add_api_resource(Video, '/video')
 add_api_resource(Thumbnail, '/thumbnail')
+add_api_resource(SignedMedia, '/media/<string:kind>/<path:path>')
 
 add_api_resource(AccessTest, '/accesstest')
 
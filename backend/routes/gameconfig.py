@@ -12,6 +12,7 @@ import json
 class GameConfig(flask_restful.Resource):
     @helper_functions.args_from_urlencoded
     @helper_functions.inject_user_from_authorization
+    @helper_functions.eager_load('_professional')
     def get(self, authorization: database.Authorization, patient_token: jwt_classes.Patient[access_levels.Id]):
         if not isinstance(authorization.owner, database.Professional):
             return 'Only professionals are allowed to access this resource', HTTPStatus.FORBIDDEN
@@ -29,6 +30,7 @@ class GameConfig(flask_restful.Resource):
 
     @helper_functions.args_from_json
     @helper_functions.inject_user_from_authorization
+    @helper_functions.eager_load('_professional')
     def post(self, authorization: database.Authorization, patient_token: jwt_classes.Patient[access_levels.Id],
              parameters: dict):
         if not isinstance(authorization.owner, database.Professional):
@@ -53,6 +55,7 @@ class GameConfig(flask_restful.Resource):
 class PatientGameConfig(flask_restful.Resource):
     @helper_functions.args_from_urlencoded
     @helper_functions.inject_user_from_authorization
+    @helper_functions.eager_load('_patient')
     def get(self, authorization: database.Authorization):
         if not isinstance(authorization.owner, database.Patient):
             return 'Only patients are allowed to access this resource', HTTPStatus.FORBIDDEN
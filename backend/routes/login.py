@@ -7,8 +7,11 @@ from typing import List, Optional, Tuple, Union
 from http import HTTPStatus
 
 from backend import helper_functions
+from backend import log
 import backend.database as db
 
+logger = log.get_logger(__name__)
+
 
 class LoginReturnType(TypedDict):
     token: str
@@ -31,14 +34,9 @@ class Login(flask_restful.Resource):
                 returned_data: LoginReturnType = {'token': user_token, 'type': type(user.owner).__name__}
                 return returned_data, HTTPStatus.OK, {'Set-Cookie': cookie}
             else:
-                msg = "passwords don't match:\n"
-                msg += f"\tinput: {hashed_password} ({len(hashed_password)})\n"
-                msg += f"\ttable: {user.password} ({len(user.password)})\n"
-                msg += f"\t salt: {user.salt}"
-                print(msg)
-                # print(len(hashed_password), len(user.password))
+                logger.info('Wrong password for authorization %s', user.id)
         else:
-            print('User not found')
+            logger.info('Login for unknown email')
 
         return 'Wrong username or password', HTTPStatus.UNAUTHORIZED
 
@@ -6,6 +6,7 @@ from backend.jwt_classes.access_levels import AccessLevels, Id
 from backend.helper_functions import first_or_abort
 import flask_restful
 import flask
+import sqlalchemy.exc
 from typing import Callable, List, Optional, Sequence, Dict, Any, Tuple, Union
 from http import HTTPStatus
 import json
@@ -13,15 +14,19 @@ from backend import helper_functions
 from backend.helper_functions import time as helper_functions_time
 from backend import database as db
 from backend import jwt_classes
-import base64
-import cv2
+from backend import media
 import uuid
-import numpy as np
+
+
+class UploadStatusObject(TypedDict):
+    status: str
+    video_id: Optional[int]
 
 
 class PatientLinking(flask_restful.Resource):
     @helper_functions.args_from_json
     @helper_functions.inject_user_from_authorization
+    @helper_functions.eager_load('_patient._links')
     def post(self, authorization: db.Authorization, professional_token: jwt_classes.Professional[Id], accept: bool)->Union[ \
         Tuple[Literal['Only patients are allowed to access this resource'], Literal[HTTPStatus.FORBIDDEN]],
         Tuple[Literal['Professional not found'], Literal[HTTPStatus.NOT_FOUND]],
@@ -52,6 +57,7 @@ class PatientLinking(flask_restful.Resource):
 
     @helper_functions.args_from_urlencoded
     @helper_functions.inject_user_from_authorization
+    @helper_functions.eager_load('_patient._links.professional.authorization')
     def get(self, authorization: db.Authorization)->Union[ \
         Tuple[Literal['Only patients are allowed to access this resource'], Literal[HTTPStatus.FORBIDDEN]],
         Tuple[List[TokenObject], Literal[HTTPStatus.OK]],
@@ -61,65 +67,247 @@ class PatientLinking(flask_restful.Resource):
         patient: db.Patient = authorization.owner
 
         def make_result(link: db.Link) -> TokenObject:
-            jwt = link.professional.to_jwt(subject=authorization, access_level=AccessLevels.personal)
+            jwt = link.professional.to_jwt_object(subject=authorization,
+                                                  access_level=AccessLevels.personal).to_cached_jwt()
             return {'token': jwt}
 
         return [make_result(link) for link in patient.invites], HTTPStatus.OK
 
 
+class UploadJobObject(TypedDict):
+    job_id: int
+
+
 class PatientVideoInput(flask_restful.Resource):
+    @helper_functions.raw_body(
+        'multipart/form-data',
+        'application/x-www-form-urlencoded',
+        media.FRAME_STREAM_MIMETYPE,
+        description='Form uploads send each frame as a base64 encoded image in a frameN field. '
+        f'{media.FRAME_STREAM_MIMETYPE} uploads send a sequence of binary frame records, each one being '
+        'the frame index (uint32), the capture timestamp in milliseconds (float64, NaN if unknown), '
+        'the image length in bytes (uint32) and the encoded image. Integers and floats are big-endian')
     @helper_functions.inject_user_from_authorization
-    def post(self, authorization: db.Authorization):
+    @helper_functions.eager_load('_patient')
+    def post(self, authorization: db.Authorization)->Union[ \
+        Tuple[Literal['Only patients are allowed to access this resource'], Literal[HTTPStatus.FORBIDDEN]],
+        Tuple[Literal['Unsupported upload content type'], Literal[HTTPStatus.UNSUPPORTED_MEDIA_TYPE]],
+        Tuple[Literal['No frames received'], Literal[HTTPStatus.BAD_REQUEST]],
+        Tuple[UploadJobObject, Literal[HTTPStatus.ACCEPTED]],
+        ]:
         if not isinstance(authorization.owner, db.Patient):
             return 'Only patients are allowed to access this resource', HTTPStatus.FORBIDDEN
         patient: db.Patient = authorization.owner
         now = helper_functions.datetime_now()
 
-        _output_filename = str(uuid.uuid4()) + '-'
-        count = 0
-        make_video_filename = lambda: _output_filename + str(count) + '.mp4'
-        make_thumb_filename = lambda: _output_filename + str(count) + '.png'
-        while os.path.isfile(os.path.join(CONSTANTS.video_folder, make_video_filename())):
-            count += 1
-        output_video_filename = make_video_filename()
-        output_thumb_filename = make_thumb_filename()
-
-        requestDict = flask.request.form.to_dict()
-        print(requestDict.keys())
-        data = []
-        thumb = None
-        for key, value in requestDict.items():
-            if key.startswith('frame'):
-                img_data = base64.b64decode(value)
-                if thumb is None:
-                    thumb = img_data
-                nparr = np.fromstring(img_data, np.uint8)  # type: ignore
-                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                # cv2.imshow('', img)
-                # cv2.waitKey(0)
-                data.append(img)
-        if thumb is None:
-            raise Exception('Thumb cannot be none. Are there any frames?')
-
-        height, width, channels = data[0].shape
-
-        # Define the codec and create VideoWriter object
-        fourcc = cv2.VideoWriter_fourcc(*'VP09')
-        out = cv2.VideoWriter(os.path.join(CONSTANTS.video_folder, output_video_filename), fourcc, 30, (width, height))
-
-        for image in data:
-            out.write(image)  # Write out frame to video
-
-        out.release()
-
-        with open(os.path.join(CONSTANTS.thumbnail_folder, output_thumb_filename), "wb") as f:
-            f.write(thumb)
+        # frames are spooled to disk as they arrive and encoded later by the encoding workers
+        spool_path = os.path.join(CONSTANTS.spool_folder, str(uuid.uuid4()) + '.frames')
+        try:
+            with media.FrameSpoolWriter(spool_path) as spool:
+                for index, timestamp, img_data in media.iter_request_frames(flask.request):
+                    spool.write(img_data, index=index, timestamp=timestamp)
+        except media.UnsupportedUploadFormat as ex:
+            os.remove(spool_path)
+            return str(ex), HTTPStatus.UNSUPPORTED_MEDIA_TYPE
+        except ValueError as ex:
+            os.remove(spool_path)
+            return f'Malformed upload: {ex}', HTTPStatus.BAD_REQUEST
+        except:
+            os.remove(spool_path)
+            raise
 
-        now = helper_functions.datetime_now()
-        video_info = db.VideoInfo(video_path=output_video_filename, thumbnail_path=output_thumb_filename, date=now, patient=patient)
+        if spool.frame_count == 0:
+            os.remove(spool_path)
+            return 'No frames received', HTTPStatus.BAD_REQUEST
+
+        job = db.EncodingJob(spool_path=spool_path, date=now, patient=patient)
+        sess = db.db.session
+        sess.add(job)
+        sess.commit()
+
+        media.submit_encoding_job(flask.current_app.config['SQLALCHEMY_DATABASE_URI'], job.id)
+        result: UploadJobObject = {'job_id': job.id}
+        return result, HTTPStatus.ACCEPTED
+
+
+class PatientUploadStatus(flask_restful.Resource):
+    @helper_functions.args_from_urlencoded
+    @helper_functions.inject_user_from_authorization
+    @helper_functions.eager_load('_patient')
+    def get(self, authorization: db.Authorization, job_id: int)->Union[ \
+        Tuple[Literal['Only patients are allowed to access this resource'], Literal[HTTPStatus.FORBIDDEN]],
+        Tuple[Literal['Upload not found'], Literal[HTTPStatus.NOT_FOUND]],
+        Tuple[UploadStatusObject, Literal[HTTPStatus.OK]],
+        ]:
+        if not isinstance(authorization.owner, db.Patient):
+            return 'Only patients are allowed to access this resource', HTTPStatus.FORBIDDEN
+        patient: db.Patient = authorization.owner
+
+        q = db.EncodingJob.query
+        q = q.filter(db.EncodingJob.id == job_id)
+        q = q.filter(db.EncodingJob.patient_id == patient.id)
+        job: Optional[db.EncodingJob] = q.one_or_none()
+        if job is None:
+            return 'Upload not found', HTTPStatus.NOT_FOUND
+
+        result: UploadStatusObject = {'status': job.status, 'video_id': job.video_id}
+        return result, HTTPStatus.OK
+
+
+class UploadSessionObject(TypedDict):
+    session_id: int
+    offset: Optional[int]
+    job_id: Optional[int]
+
+
+def _upload_session_object(session: db.UploadSession) -> UploadSessionObject:
+    # the spool is deleted once the encoding job is done
+    offset = os.path.getsize(session.spool_path) if os.path.isfile(session.spool_path) else None
+    return {
+        'session_id': session.id,
+        'offset': offset,
+        'job_id': session.job_id,
+    }
+
+
+def _get_upload_session(patient: db.Patient, session_id: int, for_update: bool = False) -> Optional[db.UploadSession]:
+    q = db.UploadSession.query
+    q = q.filter(db.UploadSession.id == session_id)
+    q = q.filter(db.UploadSession.patient_id == patient.id)
+    if for_update:
+        q = q.with_for_update()
+    return q.one_or_none()
+
+
+class PatientUploadSessions(flask_restful.Resource):
+    @helper_functions.args_from_urlencoded
+    @helper_functions.inject_user_from_authorization
+    @helper_functions.eager_load('_patient')
+    def post(self, authorization: db.Authorization)->Union[ \
+        Tuple[Literal['Only patients are allowed to access this resource'], Literal[HTTPStatus.FORBIDDEN]],
+        Tuple[UploadSessionObject, Literal[HTTPStatus.CREATED]],
+        ]:
+        if not isinstance(authorization.owner, db.Patient):
+            return 'Only patients are allowed to access this resource', HTTPStatus.FORBIDDEN
+        patient: db.Patient = authorization.owner
+
+        spool_path = os.path.join(CONSTANTS.spool_folder, str(uuid.uuid4()) + '.frames')
+        open(spool_path, 'wb').close()
 
+        session = db.UploadSession(spool_path=spool_path, date=helper_functions.datetime_now(), patient=patient)
         sess = db.db.session
-        sess.add(video_info)
+        sess.add(session)
         sess.commit()
+        return _upload_session_object(session), HTTPStatus.CREATED
+
+
+class PatientUploadSession(flask_restful.Resource):
+    @helper_functions.args_from_urlencoded
+    @helper_functions.inject_user_from_authorization
+    @helper_functions.eager_load('_patient')
+    def get(self, authorization: db.Authorization, session_id: int)->Union[ \
+        Tuple[Literal['Only patients are allowed to access this resource'], Literal[HTTPStatus.FORBIDDEN]],
+        Tuple[Literal['Upload session not found'], Literal[HTTPStatus.NOT_FOUND]],
+        Tuple[UploadSessionObject, Literal[HTTPStatus.OK]],
+        ]:
+        if not isinstance(authorization.owner, db.Patient):
+            return 'Only patients are allowed to access this resource', HTTPStatus.FORBIDDEN
+        patient: db.Patient = authorization.owner
+
+        session = _get_upload_session(patient, session_id)
+        if session is None:
+            return 'Upload session not found', HTTPStatus.NOT_FOUND
+
+        return _upload_session_object(session), HTTPStatus.OK
+
+    @helper_functions.args_from_urlencoded
+    @helper_functions.raw_body('application/octet-stream',
+                               description=f'The bytes of a {media.FRAME_STREAM_MIMETYPE} upload, '
+                               'starting at offset. Sending a chunk again is harmless')
+    @helper_functions.inject_user_from_authorization
+    @helper_functions.eager_load('_patient')
+    def put(self, authorization: db.Authorization, session_id: int, offset: int)->Union[ \
+        Tuple[Literal['Only patients are allowed to access this resource'], Literal[HTTPStatus.FORBIDDEN]],
+        Tuple[Literal['Upload session not found'], Literal[HTTPStatus.NOT_FOUND]],
+        Tuple[Literal['Upload session already finalized'], Literal[HTTPStatus.CONFLICT]],
+        Tuple[Literal['Upload session expired'], Literal[HTTPStatus.GONE]],
+        Tuple[UploadSessionObject, Literal[HTTPStatus.CONFLICT]],
+        Tuple[UploadSessionObject, Literal[HTTPStatus.OK]],
+        ]:
+        if not isinstance(authorization.owner, db.Patient):
+            return 'Only patients are allowed to access this resource', HTTPStatus.FORBIDDEN
+        patient: db.Patient = authorization.owner
+
+        session = _get_upload_session(patient, session_id)
+        if session is None:
+            return 'Upload session not found', HTTPStatus.NOT_FOUND
+        if session.job_id is not None:
+            return 'Upload session already finalized', HTTPStatus.CONFLICT
+        if not os.path.isfile(session.spool_path):
+            return 'Upload session expired', HTTPStatus.GONE
+
+        # a chunk may only start inside or right at the end of what was already received
+        # so that there are no holes in the spool. The client resumes from the returned offset
+        if offset < 0 or offset > os.path.getsize(session.spool_path):
+            return _upload_session_object(session), HTTPStatus.CONFLICT
+
+        media.write_spool_chunk(session.spool_path, offset, flask.request.stream)
+        return _upload_session_object(session), HTTPStatus.OK
+
+
+class PatientUploadSessionFinalize(flask_restful.Resource):
+    @helper_functions.args_from_urlencoded
+    @helper_functions.inject_user_from_authorization
+    @helper_functions.eager_load('_patient')
+    def post(self, authorization: db.Authorization, session_id: int)->Union[ \
+        Tuple[Literal['Only patients are allowed to access this resource'], Literal[HTTPStatus.FORBIDDEN]],
+        Tuple[Literal['Upload session not found'], Literal[HTTPStatus.NOT_FOUND]],
+        Tuple[Literal['No frames received'], Literal[HTTPStatus.BAD_REQUEST]],
+        Tuple[Literal['Upload session already finalized'], Literal[HTTPStatus.CONFLICT]],
+        Tuple[Literal['Upload session expired'], Literal[HTTPStatus.GONE]],
+        Tuple[UploadJobObject, Literal[HTTPStatus.ACCEPTED]],
+        ]:
+        if not isinstance(authorization.owner, db.Patient):
+            return 'Only patients are allowed to access this resource', HTTPStatus.FORBIDDEN
+        patient: db.Patient = authorization.owner
+
+        # the lock makes concurrent finalize calls wait here and then see the job of the first one
+        session = _get_upload_session(patient, session_id, for_update=True)
+        if session is None:
+            return 'Upload session not found', HTTPStatus.NOT_FOUND
+
+        result: UploadJobObject
+        if session.job_id is not None:
+            # finalizing twice returns the same job
+            result = {'job_id': session.job_id}
+            return result, HTTPStatus.ACCEPTED
+
+        if not os.path.isfile(session.spool_path):
+            return 'Upload session expired', HTTPStatus.GONE
+
+        try:
+            frames = media.read_spool_index(session.spool_path)
+        except ValueError as ex:
+            return f'Malformed upload: {ex}', HTTPStatus.BAD_REQUEST
+        if not frames:
+            return 'No frames received', HTTPStatus.BAD_REQUEST
+
+        job = db.EncodingJob(spool_path=session.spool_path, date=session.date, patient=patient)
+        session.job = job
+        sess = db.db.session
+        sess.add(job)
+        sess.add(session)
+        try:
+            sess.commit()
+        except sqlalchemy.exc.IntegrityError:
+            # databases without row locks: another call created the job of this spool first
+            sess.rollback()
+            session = _get_upload_session(patient, session_id)
+            if session is None or session.job_id is None:
+                return 'Upload session already finalized', HTTPStatus.CONFLICT
+            result = {'job_id': session.job_id}
+            return result, HTTPStatus.ACCEPTED
 
-        return 'OK'
\ No newline at end of file
+        media.submit_encoding_job(flask.current_app.config['SQLALCHEMY_DATABASE_URI'], job.id)
+        result = {'job_id': job.id}
+        return result, HTTPStatus.ACCEPTED
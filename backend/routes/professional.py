@@ -1,12 +1,15 @@
 from backend.routes import TokenObject
-from typing import Literal
+from typing import Literal, TypedDict
 from backend.jwt_classes.access_levels import AccessLevels
 from backend.helper_functions import first_or_abort
 import flask_restful
 import flask
 from typing import Callable, List, Optional, Sequence, Dict, Any, Tuple, Union
 from http import HTTPStatus
+import datetime
 import json
+import sqlalchemy
+import sqlalchemy.orm
 from backend import helper_functions
 from backend import database as db
 from backend import jwt_classes
@@ -15,6 +18,7 @@ from backend import jwt_classes
 class ProfessionalLinking(flask_restful.Resource):
     @helper_functions.args_from_json
     @helper_functions.inject_user_from_authorization
+    @helper_functions.eager_load('_professional')
     def post(self, authorization: db.Authorization, cpf: str)->Union[ \
         Tuple[Literal['Only professionals are allowed to access this resource'], Literal[HTTPStatus.FORBIDDEN]],
         Tuple[Literal['Patient not found'], Literal[HTTPStatus.NOT_FOUND]],
@@ -43,6 +47,7 @@ class ProfessionalLinking(flask_restful.Resource):
 
     @helper_functions.args_from_urlencoded
     @helper_functions.inject_user_from_authorization
+    @helper_functions.eager_load('_professional._links.patient.authorization')
     def get(self, authorization: db.Authorization)->Union[ \
         Tuple[Literal['Only professionals are allowed to access this resource'], Literal[HTTPStatus.FORBIDDEN]],
         Tuple[List[TokenObject], Literal[HTTPStatus.OK]],
@@ -52,7 +57,63 @@ class ProfessionalLinking(flask_restful.Resource):
         professional: db.Professional = authorization.owner
 
         def make_result(link: db.Link) -> TokenObject:
-            jwt = link.patient.to_jwt(subject=authorization, access_level=AccessLevels.personal)
+            jwt = link.patient.to_jwt_object(subject=authorization, access_level=AccessLevels.personal).to_cached_jwt()
             return {'token': jwt}
 
         return [make_result(link) for link in professional.links], HTTPStatus.OK
+
+
+class PatientSummaryObject(TypedDict):
+    token: str
+    session_count: int
+    last_session: Optional[int]
+    recent_sessions: int
+
+
+class ProfessionalDashboard(flask_restful.Resource):
+    @helper_functions.args_from_urlencoded
+    @helper_functions.inject_user_from_authorization
+    @helper_functions.eager_load('_professional')
+    def get(self, authorization: db.Authorization, days: int = 7)->Union[ \
+        Tuple[Literal['Only professionals are allowed to access this resource'], Literal[HTTPStatus.FORBIDDEN]],
+        Tuple[List[PatientSummaryObject], Literal[HTTPStatus.OK]],
+        ]:
+        '''Session stats of every linked patient, with the token used to fetch their sessions'''
+        if not isinstance(authorization.owner, db.Professional):
+            return 'Only professionals are allowed to access this resource', HTTPStatus.FORBIDDEN
+        professional: db.Professional = authorization.owner
+        recent_since = helper_functions.datetime_now() - datetime.timedelta(days=days)
+
+        stats_q = db.db.session.query(
+            db.VideoInfo.patient_id.label('patient_id'),
+            sqlalchemy.func.count(db.VideoInfo.id).label('session_count'),
+            sqlalchemy.func.max(db.VideoInfo.date).label('last_session'),
+            sqlalchemy.func.sum(sqlalchemy.case((db.VideoInfo.date >= recent_since, 1), else_=0)).label('recent_sessions'),
+        )
+        stats_q = stats_q.join(db.Link, db.Link.patient_id == db.VideoInfo.patient_id)
+        stats_q = stats_q.filter(db.Link.professional_id == professional.id)
+        stats_q = stats_q.filter(db.Link.accepted == True)
+        stats = stats_q.group_by(db.VideoInfo.patient_id).subquery()
+
+        q = db.db.session.query(db.Patient, stats.c.session_count, stats.c.last_session, stats.c.recent_sessions)
+        q = q.join(db.Link, db.Link.patient_id == db.Patient.id)
+        q = q.join(db.Patient.authorization)
+        q = q.outerjoin(stats, stats.c.patient_id == db.Patient.id)
+        q = q.filter(db.Link.professional_id == professional.id)
+        q = q.filter(db.Link.accepted == True)
+        q = q.options(sqlalchemy.orm.contains_eager(db.Patient.authorization))
+        q = q.order_by(db.Patient.id)
+
+        def make_result(patient: db.Patient, session_count: Optional[int], last_session: Any,
+                        recent_sessions: Optional[int]) -> PatientSummaryObject:
+            if isinstance(last_session, str):
+                # sqlite returns aggregated dates as strings
+                last_session = datetime.datetime.fromisoformat(last_session)
+            return {
+                'token': patient.to_jwt_object(subject=authorization, access_level=AccessLevels.personal).to_cached_jwt(),
+                'session_count': session_count or 0,
+                'last_session': helper_functions.fulldatetime_to_timestamp(last_session) if last_session else None,
+                'recent_sessions': int(recent_sessions or 0),
+            }
+
+        return [make_result(*row) for row in q.all()], HTTPStatus.OK
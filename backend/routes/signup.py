@@ -34,7 +34,10 @@ class PatientSignup(flask_restful.Resource):
                 new_user = db.Patient(name=name,
                                       cpf=cpf,
                                       game_config='{}',
-                                      authorization=db.Authorization(email=email, password=hashed_password, salt=salt))
+                                      authorization=db.Authorization(email=email,
+                                                                     password=hashed_password,
+                                                                     salt=salt,
+                                                                     owner_type=db.OwnerType.patient))
 
                 db.db.session.add(new_user)
                 db.db.session.commit()
@@ -81,7 +84,8 @@ class ProfessionalSignup(flask_restful.Resource):
                                            institution=institution,
                                            authorization=db.Authorization(email=email,
                                                                           password=hashed_password,
-                                                                          salt=salt))
+                                                                          salt=salt,
+                                                                          owner_type=db.OwnerType.professional))
 
                 db.db.session.add(new_user)
                 db.db.session.commit()
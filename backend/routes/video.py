@@ -1,51 +1,159 @@
+import base64
 import datetime
+import json
+import os
+import time
 import flask
 import flask_restful
-from typing import Literal
+import sqlalchemy
+from typing import Literal, TypedDict
 from backend import jwt_classes
-from backend.database import VideoInfo
+from backend import media
 from backend.helper_functions.decorators import inject_user_from_authorization
-from backend.jwt_classes.access_levels import AccessLevels, Id
+from backend.jwt_classes.access_levels import Id
 from backend.constants import CONSTANTS
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 from http import HTTPStatus
-from backend.helper_functions import time as helper_functions_time
 
 from backend import helper_functions
 import backend.database as db
 
 
+class SessionObject(TypedDict):
+    id: int
+    thumbnail_url: str
+    video_url: str
+
+
+def _session_object(video: Any) -> SessionObject:
+    '''video is a VideoInfo or a row with its id and paths'''
+    return {
+        'id': video.id,
+        'thumbnail_url': media.sign_media_url('thumbnail', video.thumbnail_path),
+        'video_url': media.sign_media_url('video', video.video_path),
+    }
+
+
+class SessionsPageObject(TypedDict):
+    sessions: Dict[str, List[SessionObject]]
+    next: Optional[str]
+
+
+def _sessions_query(patient_id: int, from_date: Optional[int], to_date: Optional[int]):
+    '''The patient's sessions between from_date (inclusive) and to_date (exclusive), with their day computed
+    by the database, so only the requested window is loaded'''
+    day = sqlalchemy.func.date(db.VideoInfo.date).label('day')
+    q = db.db.session.query(db.VideoInfo.id, db.VideoInfo.date, day, db.VideoInfo.thumbnail_path,
+                            db.VideoInfo.video_path)
+    q = q.filter(db.VideoInfo.patient_id == patient_id)
+    if from_date is not None:
+        q = q.filter(db.VideoInfo.date >= helper_functions.timestamp_to_fulldatetime(from_date))
+    if to_date is not None:
+        q = q.filter(db.VideoInfo.date < helper_functions.timestamp_to_fulldatetime(to_date))
+    return q
+
+
+def _group_by_day(videos: Iterable[Any], time_delta: float) -> Dict[str, List[SessionObject]]:
+    '''Groups rows already ordered by date'''
+    days: Dict[str, List[SessionObject]] = {}
+    last_day = None
+    day_sessions: List[SessionObject] = []
+    for video in videos:
+        if video.day != last_day:
+            # mysql returns dates, sqlite returns strings
+            date = datetime.date.fromisoformat(str(video.day))
+            day_start = datetime.datetime(date.year, date.month, date.day, tzinfo=datetime.timezone.utc)
+            day_sessions = days.setdefault(
+                str(helper_functions.datetime_to_timestamp(day_start + datetime.timedelta(hours=time_delta))), [])
+            last_day = video.day
+        day_sessions.append(_session_object(video))
+    return days
+
+
+def _encode_cursor(video: Any) -> str:
+    raw = json.dumps([video.date.isoformat(), video.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    date, video_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.datetime.fromisoformat(date), int(video_id)
+
+
+def _sessions_page(q, time_delta: float, limit: Optional[int], cursor: Optional[str])->Union[ \
+    Tuple[Literal['Invalid cursor'], Literal[HTTPStatus.BAD_REQUEST]],
+    Tuple[SessionsPageObject, Literal[HTTPStatus.OK]],
+    ]:
+    '''Newest sessions first, paginated by (date, id) so that pages stay stable while new sessions are uploaded'''
+    if limit is None:
+        limit = CONSTANTS.default_page_size
+    limit = min(max(limit, 1), CONSTANTS.max_page_size)
+
+    if cursor is not None:
+        try:
+            cursor_date, cursor_id = _decode_cursor(cursor)
+        except (ValueError, TypeError):
+            return 'Invalid cursor', HTTPStatus.BAD_REQUEST
+        q = q.filter(
+            sqlalchemy.or_(db.VideoInfo.date < cursor_date,
+                           sqlalchemy.and_(db.VideoInfo.date == cursor_date, db.VideoInfo.id < cursor_id)))
+
+    q = q.order_by(db.VideoInfo.date.desc(), db.VideoInfo.id.desc())
+    videos = q.limit(limit + 1).all()
+    next_cursor = _encode_cursor(videos[limit - 1]) if len(videos) > limit else None
+    result: SessionsPageObject = {'sessions': _group_by_day(videos[:limit], time_delta), 'next': next_cursor}
+    return result, HTTPStatus.OK
+
+
+def _sessions(patient_id: int, time_delta: float, from_date: Optional[int], to_date: Optional[int],
+              limit: Optional[int], cursor: Optional[str]):
+    q = _sessions_query(patient_id, from_date, to_date)
+    if limit is None and cursor is None:
+        # unpaginated shape, kept for older clients
+        return _group_by_day(q.order_by(db.VideoInfo.date, db.VideoInfo.id), time_delta), HTTPStatus.OK
+    return _sessions_page(q, time_delta, limit, cursor)
+
+
+def _get_accessible_video(authorization: db.Authorization, video_id: int) -> Optional[db.VideoInfo]:
+    owner = authorization.owner
+    if isinstance(owner, db.Professional):
+        q = db.VideoInfo.query
+        q = q.join(db.VideoInfo.patient)
+        q = q.join(db.Patient._links)
+        q = q.filter(db.VideoInfo.id == video_id)
+        q = q.filter(db.Link.accepted == True)
+        q = q.filter(db.Link.professional_id == owner.id)
+        return q.one_or_none()
+
+    elif isinstance(owner, db.Patient):
+        q = db.VideoInfo.query
+        q = q.filter(db.VideoInfo.id == video_id)
+        q = q.filter(db.VideoInfo.patient_id == owner.id)
+        return q.one_or_none()
+    else:
+        raise Exception('Owner expected to be either Patient or Professional')
+
+
 class Video(flask_restful.Resource):
     @helper_functions.args_from_urlencoded
     @inject_user_from_authorization
-    def get(self, authorization: db.Authorization, video_id: int)->Union[ \
+    def get(self, authorization: jwt_classes.Authorization, video_id: int)->Union[ \
         Tuple[Literal['Video not found'], Literal[HTTPStatus.NOT_FOUND]],
         flask.Response
         ]:
 
-        owner = authorization.owner
-        video: Optional[db.VideoInfo]
-        if isinstance(owner, db.Professional):
-            q = db.VideoInfo.query
-            q = q.join(db.VideoInfo.patient)
-            q = q.join(db.Patient._links)
-            q = q.filter(db.VideoInfo.id == video_id)
-            q = q.filter(db.Link.accepted == True)
-            q = q.filter(db.Link.professional_id == owner.id)
-            video = q.one_or_none()
-
-        elif isinstance(owner, db.Patient):
-            q = db.VideoInfo.query
-            q = q.filter(db.VideoInfo.id == video_id)
-            q = q.filter(db.VideoInfo.patient_id == owner.id)
-            video = q.one_or_none()
-        else:
-            raise Exception('Owner expected to be either Patient or Professional')
+        # revalidating a copy this user already received needs no access query
+        not_modified = media.revalidate('video', authorization._id, video_id)
+        if not_modified is not None:
+            return not_modified
 
+        video = _get_accessible_video(helper_functions.request_authorization(), video_id)
         if video is None:
             return 'Video not found', HTTPStatus.NOT_FOUND
 
-        return flask.send_from_directory(CONSTANTS.video_folder, video.video_path)
+        path = os.path.join(CONSTANTS.video_folder, video.video_path)
+        etag = media.media_etag('video', authorization._id, video.id, video.video_path, path)
+        return media.send_media(CONSTANTS.video_folder, video.video_path, etag)
 
     @helper_functions.args_from_urlencoded
     @inject_user_from_authorization
@@ -54,25 +162,7 @@ class Video(flask_restful.Resource):
         Tuple[Literal['Video deleted'], Literal[HTTPStatus.OK]],
         ]:
 
-        owner = authorization.owner
-        video: Optional[db.VideoInfo]
-        if isinstance(owner, db.Professional):
-            q = db.VideoInfo.query
-            q = q.join(db.VideoInfo.patient)
-            q = q.join(db.Patient._links)
-            q = q.filter(db.VideoInfo.id == video_id)
-            q = q.filter(db.Link.accepted == True)
-            q = q.filter(db.Link.professional_id == owner.id)
-            video = q.one_or_none()
-
-        elif isinstance(owner, db.Patient):
-            q = db.VideoInfo.query
-            q = q.filter(db.VideoInfo.id == video_id)
-            q = q.filter(db.VideoInfo.patient_id == owner.id)
-            video = q.one_or_none()
-        else:
-            raise Exception('Owner expected to be either Patient or Professional')
-
+        video = _get_accessible_video(authorization, video_id)
         if video is None:
             return 'Video not found', HTTPStatus.NOT_FOUND
 
@@ -84,75 +174,53 @@ class Video(flask_restful.Resource):
 class Thumbnail(flask_restful.Resource):
     @helper_functions.args_from_urlencoded
     @inject_user_from_authorization
-    def get(self, authorization: db.Authorization, video_id: int)->Union[ \
+    def get(self, authorization: jwt_classes.Authorization, video_id: int)->Union[ \
         Tuple[Literal['Thumb not found'], Literal[HTTPStatus.NOT_FOUND]],
         flask.Response
         ]:
 
-        owner = authorization.owner
-        video: Optional[db.VideoInfo]
-        if isinstance(owner, db.Professional):
-            q = db.VideoInfo.query
-            q = q.join(db.VideoInfo.patient)
-            q = q.join(db.Patient._links)
-            q = q.filter(db.VideoInfo.id == video_id)
-            q = q.filter(db.Link.accepted == True)
-            q = q.filter(db.Link.professional_id == owner.id)
-            video = q.one_or_none()
-
-        elif isinstance(owner, db.Patient):
-            q = db.VideoInfo.query
-            q = q.filter(db.VideoInfo.id == video_id)
-            q = q.filter(db.VideoInfo.patient_id == owner.id)
-            video = q.one_or_none()
-        else:
-            raise Exception('Owner expected to be either Patient or Professional')
+        not_modified = media.revalidate('thumbnail', authorization._id, video_id)
+        if not_modified is not None:
+            return not_modified
 
+        video = _get_accessible_video(helper_functions.request_authorization(), video_id)
         if video is None:
             return 'Thumb not found', HTTPStatus.NOT_FOUND
 
-        return flask.send_from_directory(CONSTANTS.thumbnail_folder, video.thumbnail_path)
+        path = os.path.join(CONSTANTS.thumbnail_folder, video.thumbnail_path)
+        etag = media.media_etag('thumbnail', authorization._id, video.id, video.thumbnail_path, path)
+        return media.send_media(CONSTANTS.thumbnail_folder, video.thumbnail_path, etag)
 
 
 class PatientSessions(flask_restful.Resource):
     @helper_functions.args_from_urlencoded
     @inject_user_from_authorization
-    def get(self, authorization: db.Authorization, time_delta:float)->Union[ \
+    @helper_functions.eager_load('_patient')
+    def get(self, authorization: db.Authorization, time_delta:float, from_date: int = None, to_date: int = None,
+            limit: int = None, cursor: str = None)->Union[ \
         Tuple[Literal['Only patients are allowed to access this resource'], Literal[HTTPStatus.FORBIDDEN]],
-        Tuple[Dict[str, List[Dict[str, int]]], Literal[HTTPStatus.OK]]
+        Tuple[Literal['Invalid cursor'], Literal[HTTPStatus.BAD_REQUEST]],
+        Tuple[Union[Dict[str, List[SessionObject]], SessionsPageObject], Literal[HTTPStatus.OK]]
         ]:
 
-        now = helper_functions.datetime_now()
-        today = helper_functions_time._datify(now) + datetime.timedelta(hours=time_delta)
-
         owner = authorization.owner
         if not isinstance(owner, db.Patient):
             return 'Only patients are allowed to access this resource', HTTPStatus.FORBIDDEN
 
         patient = owner
-        videos = patient.videos
-        days: Dict[datetime.datetime, List[int]] = {}
-        for video in sorted(videos, key=lambda video_info: video_info.date):
-            day = helper_functions_time._datify(video.date) + datetime.timedelta(hours=time_delta)
-            if day not in days:
-                days[day] = []
-            days[day].append(video.id)
-
-        return {
-            str(helper_functions.datetime_to_timestamp(day)): [{
-                "id": video_id
-            } for video_id in video_ids]
-            for day, video_ids in days.items()
-        }, HTTPStatus.OK
+        return _sessions(patient.id, time_delta, from_date, to_date, limit, cursor)
 
 
 class ProfessionalPatientSessions(flask_restful.Resource):
     @helper_functions.args_from_urlencoded
     @inject_user_from_authorization
-    def get(self, authorization: db.Authorization, patient_token: jwt_classes.Patient[Id], time_delta:float)->Union[ \
+    @helper_functions.eager_load('_professional')
+    def get(self, authorization: db.Authorization, patient_token: jwt_classes.Patient[Id], time_delta:float,
+            from_date: int = None, to_date: int = None, limit: int = None, cursor: str = None)->Union[ \
         Tuple[Literal['Only professionals are allowed to access this resource'], Literal[HTTPStatus.FORBIDDEN]],
         Tuple[Literal['Patient not found'], Literal[HTTPStatus.NOT_FOUND]],
-        Tuple[Dict[str, List[Dict[str, int]]], Literal[HTTPStatus.OK]]
+        Tuple[Literal['Invalid cursor'], Literal[HTTPStatus.BAD_REQUEST]],
+        Tuple[Union[Dict[str, List[SessionObject]], SessionsPageObject], Literal[HTTPStatus.OK]]
         ]:
 
         owner = authorization.owner
@@ -169,17 +237,25 @@ class ProfessionalPatientSessions(flask_restful.Resource):
         if patient is None:
             return 'Patient not found', HTTPStatus.NOT_FOUND
 
-        videos = patient.videos
-        days: Dict[datetime.datetime, List[int]] = {}
-        for video in sorted(videos, key=lambda video_info: video_info.date):
-            day = helper_functions_time._datify(video.date) + datetime.timedelta(hours=time_delta)
-            if day not in days:
-                days[day] = []
-            days[day].append(video.id)
-
-        return {
-            str(helper_functions.datetime_to_timestamp(day)): [{
-                "id": video_id
-            } for video_id in video_ids]
-            for day, video_ids in days.items()
-        }, HTTPStatus.OK
+        return _sessions(patient.id, time_delta, from_date, to_date, limit, cursor)
+
+
+class SignedMedia(flask_restful.Resource):
+    @helper_functions.args_from_urlencoded
+    def get(self, kind: str, path: str, expires: int, signature: str)->Union[ \
+        Tuple[Literal['Invalid or expired media url'], Literal[HTTPStatus.FORBIDDEN]],
+        Tuple[Literal['Media not found'], Literal[HTTPStatus.NOT_FOUND]],
+        flask.Response
+        ]:
+
+        # the signature is the authorization, no database access is needed
+        folder = media.media_folder(kind)
+        if folder is None or not media.verify_media_signature(kind, path, expires, signature):
+            return 'Invalid or expired media url', HTTPStatus.FORBIDDEN
+
+        full_path = os.path.join(folder, path)
+        if not os.path.isfile(full_path):
+            return 'Media not found', HTTPStatus.NOT_FOUND
+
+        max_age = max(0, expires - int(time.time()))
+        return media.send_media(folder, path, media.content_tag(path, full_path), f'private, max-age={max_age}')
@@ -0,0 +1,50 @@
+'''JSON encoding of the api responses and decoding of the request bodies.
+Uses orjson when it is installed and the standard library otherwise'''
+import json
+from http import HTTPStatus
+from typing import Any, Dict, Optional
+
+import flask
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+backend_name = 'orjson' if orjson is not None else 'json'
+
+if orjson is not None:
+
+    def dumps(data: Any, indent: bool = False) -> bytes:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option)
+
+    loads = orjson.loads
+
+else:
+
+    def dumps(data: Any, indent: bool = False) -> bytes:
+        return (json.dumps(data, indent=4 if indent else None) + '\n').encode()
+
+    loads = json.loads
+
+
+def output_json(data: Any, code: int, headers: Optional[Dict[str, str]] = None) -> flask.Response:
+    '''flask_restful representation for application/json'''
+    response = flask.current_app.response_class(dumps(data, indent=flask.current_app.debug),
+                                                status=code,
+                                                mimetype='application/json')
+    response.headers.extend(headers or {})
+    return response
+
+
+def request_json() -> Any:
+    '''The decoded body of the current request. Bodies that are not json are left to flask'''
+    if not flask.request.is_json:
+        return flask.request.json
+    try:
+        return loads(flask.request.get_data(cache=True))
+    except ValueError:
+        flask.abort(HTTPStatus.BAD_REQUEST, description='Failed to decode JSON object')
@@ -0,0 +1,41 @@
+'''Per-token cost of the jwt objects. Run from the repository root, on this and on an older checkout to compare:
+
+    python -m benchmarks.jwt_objects
+'''
+import os
+import timeit
+
+os.environ.setdefault('JWT_KEY', 'benchmark')
+
+from backend import jwt_classes
+from backend.jwt_classes.access_levels import AccessLevels
+
+FIELDS = dict(_id=1, name='name', registration_id='r1', email='e@mail.com', institution='i', cpf='1')
+
+
+def construct():
+    return jwt_classes.Professional(subject=1, access_level=AccessLevels.private, **FIELDS)
+
+
+def main(number: int = 20000):
+    professional = construct()
+    token = professional.to_jwt()
+    jwt_classes.Professional.from_jwt(token, subject=1)  # warms the verified token cache, if present
+
+    def downgrade():
+        construct().downgrade_access(AccessLevels.public)
+
+    cases = {
+        'construct': construct,
+        'to_dict': professional.to_dict,
+        'construct + downgrade': downgrade,
+        'from_jwt': lambda: jwt_classes.Professional.from_jwt(token, subject=1),
+        'to_jwt': professional.to_jwt,
+    }
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=number, repeat=5))
+        print(f'{name:>24}: {seconds / number * 1e6:8.2f} us')
+
+
+if __name__ == '__main__':
+    main()
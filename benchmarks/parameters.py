@@ -0,0 +1,72 @@
+'''Per-request cost of checking the arguments of every route decorated with args_from_json or
+args_from_urlencoded, compiled validator against the check_parameters path. Run from the repository root:
+
+    python -m benchmarks.parameters
+'''
+import os
+import timeit
+from typing import Any, Dict
+
+os.environ.setdefault('JWT_KEY', 'benchmark')
+
+import server
+from backend import jwt_classes
+from backend.jwt_classes import _resolve_access_level
+from backend.jwt_classes.access_levels import AccessLevels
+from backend.helper_functions import decorators
+
+SUBJECT = 1
+SAMPLE_VALUES = {str: 'value', int: 1, float: 1.5, bool: True, dict: {'key': 'value'}, list: ['value']}
+
+
+def sample_token(jwt_class) -> str:
+    fields = jwt_class.field_plan(AccessLevels.max.value).annotations
+    values = {name: SAMPLE_VALUES[_resolve_access_level(t)] for name, t in fields.items()}
+    return jwt_class(subject=SUBJECT, access_level=AccessLevels.max, **values).to_jwt()
+
+
+def sample_source(validator: decorators.ParameterValidator) -> Dict[str, Any]:
+    query_string = validator.type_check is decorators.convert_types
+    source = {}
+    for name, param_type in validator.types.items():
+        if jwt_classes.is_subclass(param_type, jwt_classes.JwtObject):
+            value = sample_token(param_type.__origin__)
+        else:
+            value = SAMPLE_VALUES[param_type]
+            if query_string:
+                value = str(value)
+        source[name] = value
+    return source
+
+
+def main(number: int = 2000):
+    app = server.create_application()
+    from backend.routes import api
+
+    total_legacy = total_compiled = 0.0
+    with app.test_request_context():
+        for resource, *routes in api.resources:
+            for method in ('get', 'post', 'put', 'delete'):
+                validator = getattr(getattr(resource, method, None), 'validator', None)
+                if validator is None:
+                    continue
+                source = sample_source(validator)
+
+                def legacy():
+                    decorators.check_parameters(dict(source), validator.func, validator.type_check, SUBJECT)
+
+                def compiled():
+                    validator(dict(source), SUBJECT)
+
+                legacy_seconds = min(timeit.repeat(legacy, number=number, repeat=3)) / number
+                compiled_seconds = min(timeit.repeat(compiled, number=number, repeat=3)) / number
+                total_legacy += legacy_seconds
+                total_compiled += compiled_seconds
+                print(f'{resource.__name__ + "." + method:>36}: {legacy_seconds * 1e6:8.2f} us -> '
+                      f'{compiled_seconds * 1e6:8.2f} us')
+
+    print(f'{"total":>36}: {total_legacy * 1e6:8.2f} us -> {total_compiled * 1e6:8.2f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+'''Cost of encoding representative responses and decoding request bodies with the json backend
+against the standard library. Run from the repository root:
+
+    python -m benchmarks.serialization
+'''
+import json
+import os
+import timeit
+
+os.environ.setdefault('JWT_KEY', 'benchmark')
+
+from backend import jwt_classes, media, serialization
+from backend.jwt_classes.access_levels import AccessLevels
+
+
+def sessions_payload(days: int = 365, sessions_per_day: int = 3):
+    '''The shape returned by PatientSessions.get for a year of sessions'''
+    first_day = 1735689600
+    return {
+        str(first_day + day * 86400): [{
+            'id': day * sessions_per_day + i,
+            'thumbnail_url': media.sign_media_url('thumbnail', f'ab/cd/{day:064x}.png'),
+            'video_url': media.sign_media_url('video', f'ab/cd/{day:064x}.mp4'),
+        } for i in range(sessions_per_day)]
+        for day in range(days)
+    }
+
+
+def links_payload(patients: int = 300):
+    '''The shape returned by ProfessionalLinking.get for a professional with many patients'''
+    return [{
+        'token':
+        jwt_classes.Patient(subject=1,
+                            access_level=AccessLevels.personal,
+                            _id=i,
+                            name=f'patient {i}',
+                            email=f'patient{i}@mail.com',
+                            cpf=f'{i:011d}').to_jwt()
+    } for i in range(patients)]
+
+
+def main(number: int = 50):
+    payloads = {'PatientSessions.get': sessions_payload(), 'ProfessionalLinking.get': links_payload()}
+    print(f'json backend: {serialization.backend_name}')
+    for name, payload in payloads.items():
+        body = serialization.dumps(payload)
+        cases = {
+            'encode stdlib': lambda: (json.dumps(payload) + '\n').encode(),
+            f'encode {serialization.backend_name}': lambda: serialization.dumps(payload),
+            'decode stdlib': lambda: json.loads(body),
+            f'decode {serialization.backend_name}': lambda: serialization.loads(body),
+        }
+        print(f'{name} ({len(body)} bytes)')
+        for case_name, case in cases.items():
+            seconds = min(timeit.repeat(case, number=number, repeat=5)) / number
+            print(f'{case_name:>24}: {seconds * 1e3:8.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,3 @@
+import sys
+import server
+server.collect_garbage(dry_run='--dry-run' in sys.argv)
\ No newline at end of file
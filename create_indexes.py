@@ -0,0 +1,2 @@
+import server
+server.create_indexes()
\ No newline at end of file
@@ -1 +1,17 @@
+import os
+import shutil
+
 limit_request_line = 8189
+
+# metrics of every worker are written to this directory and aggregated by /metrics
+prometheus_multiproc_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.abspath('./logs/metrics'))
+
+
+def on_starting(server):
+    shutil.rmtree(prometheus_multiproc_dir, ignore_errors=True)
+    os.makedirs(prometheus_multiproc_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,2 @@
+import server
+server.migrate_encoding_jobs()
\ No newline at end of file
@@ -0,0 +1,2 @@
+import server
+server.migrate_owner_type()
\ No newline at end of file
@@ -0,0 +1,2 @@
+import server
+server.migrate_shared_media()
\ No newline at end of file
@@ -0,0 +1,2 @@
+import server
+server.migrate_storage()
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+import re
 from typing import Callable
 
 import flask
@@ -57,6 +58,7 @@ def create_OAS():
     from pprint import pprint
     import yaml
 
+    path_param_re = r'<(?:[^<>:]+:)?([^<>]+)>'
     conf = {
         "swagger": "2.0",
         "host": "localhost:5000",
@@ -69,7 +71,10 @@ def create_OAS():
             "version": "1.0.0"
         }
     }
-    for path, resource in docs.items():
+    for route, resource in docs.items():
+        # flask's /<int:job_id> becomes swagger's /{job_id}
+        path_params = re.findall(path_param_re, route)
+        path = re.sub(path_param_re, r'{\1}', route)
         class_name = resource.__name__
         class_module = resource.__module__
         conf['tags'].append({"name": class_name})
@@ -86,7 +91,12 @@ def create_OAS():
                     
                 conf["paths"][path][method]['tags'] = [class_name]
                 parameters = ed['parameters']
-                if parameters and 'schema' in parameters[0]:
+                for parameter in parameters:
+                    if parameter['in'] != 'body' and parameter['name'] in path_params:
+                        parameter['in'] = 'path'
+                        parameter['required'] = True
+                        parameter.pop('default', None)
+                if parameters and 'schema' in parameters[0] and 'required' in parameters[0]['schema']:
                     # print('has schema in parameters')
                     req = parameters[0]['schema']['required']
                     if not req:
@@ -102,4 +112,147 @@ def create_all():
     import backend.database as models
     db = models.db
     db.create_all()
-   
\ No newline at end of file
+
+
+def create_indexes():
+    '''Adds the indexes declared in the models that are missing from an existing database'''
+    create_application().app_context().push()
+    import backend.database as models
+    _create_missing_indexes(models.db.engine)
+
+
+def _create_missing_indexes(engine):
+    import sqlalchemy
+    import backend.database as models
+    inspector = sqlalchemy.inspect(engine)
+
+    created = 0
+    for table in models.db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue  # create_all creates the table with its indexes
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            print(f'Creating index {index.name} on {table.name}')
+            index.create(bind=engine)
+            created += 1
+
+    print(f'{created} indexes created')
+
+
+def _add_missing_column(engine, column):
+    '''Adds a nullable model column to its table in an existing database'''
+    import sqlalchemy
+    table = column.table
+    existing_columns = {c['name'] for c in sqlalchemy.inspect(engine).get_columns(table.name)}
+    if column.name in existing_columns:
+        return
+    quote = engine.dialect.identifier_preparer.quote
+    column_type = column.type.compile(dialect=engine.dialect)
+    print(f'Adding column {column.name} to {table.name}')
+    with engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text(f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}'))
+
+
+def migrate_owner_type():
+    '''Adds Authorization.owner_type to an existing database and fills it in for the rows created before it'''
+    create_application().app_context().push()
+    import sqlalchemy
+    import backend.database as models
+    db = models.db
+    engine = db.engine
+    table = models.Authorization.__table__
+    column = table.c.owner_type
+    _add_missing_column(engine, column)
+
+    owners = {models.OwnerType.patient: models.Patient, models.OwnerType.professional: models.Professional}
+    with engine.begin() as connection:
+        for owner_type, owner_model in owners.items():
+            owner_ids = sqlalchemy.select(owner_model.__table__.c.authorization_id)
+            update = table.update().where(column.is_(None)).where(table.c.id.in_(owner_ids)).values(owner_type=owner_type)
+            result = connection.execute(update)
+            print(f'{result.rowcount} {owner_type} authorizations backfilled')
+
+
+def migrate_encoding_jobs():
+    '''Adds EncodingJob.updated to an existing database. Unfinished jobs created before it count as stale'''
+    create_application().app_context().push()
+    import backend.database as models
+    _add_missing_column(models.db.engine, models.EncodingJob.__table__.c.updated)
+
+
+def migrate_shared_media():
+    '''Lets VideoInfo rows share stored files: replaces the unique indexes on their paths with plain ones'''
+    create_application().app_context().push()
+    import sqlalchemy
+    import backend.database as models
+    engine = models.db.engine
+    table = models.VideoInfo.__table__
+    columns = {table.c.video_path.name, table.c.thumbnail_path.name}
+    inspector = sqlalchemy.inspect(engine)
+
+    unique = {c['name'] for c in inspector.get_unique_constraints(table.name) if set(c['column_names']) <= columns}
+    unique |= {i['name'] for i in inspector.get_indexes(table.name) if i['unique'] and set(i['column_names']) <= columns}
+    if unique and engine.dialect.name == 'sqlite':
+        print(f'sqlite cannot drop the unique constraints of {table.name}, recreate the database')
+        return
+
+    quote = engine.dialect.identifier_preparer.quote
+    for name in unique:
+        print(f'Dropping unique index {name} on {table.name}')
+        with engine.begin() as connection:
+            connection.execute(sqlalchemy.text(f'DROP INDEX {quote(name)} ON {quote(table.name)}'))
+    _create_missing_indexes(engine)
+
+
+def migrate_storage(batch_size: int = 500):
+    '''Moves the videos and thumbnails saved in the old flat folders into the sharded, content-addressed layout'''
+    create_application().app_context().push()
+    import backend.database as models
+    from backend.media import storage
+    db = models.db
+    folders = {'video_path': CONSTANTS.video_folder, 'thumbnail_path': CONSTANTS.thumbnail_folder}
+
+    migrated = 0
+    last_id = 0
+    while True:
+        q = models.VideoInfo.query
+        q = q.filter(models.VideoInfo.id > last_id)
+        q = q.order_by(models.VideoInfo.id)
+        videos = q.limit(batch_size).all()
+        if not videos:
+            break
+
+        remove_old_files = []
+        for video in videos:
+            for attribute, folder in folders.items():
+                relative_path = getattr(video, attribute)
+                if storage.is_sharded(relative_path):
+                    continue
+                if not os.path.isfile(os.path.join(folder, relative_path)):
+                    print(f'Missing file for video {video.id}: {relative_path}')
+                    continue
+
+                new_relative_path, remove_old_file = storage.migrate_flat_file(folder, relative_path)
+                setattr(video, attribute, new_relative_path)
+                remove_old_files.append(remove_old_file)
+
+        # old files are only removed once the rows point to the new ones
+        db.session.commit()
+        for remove_old_file in remove_old_files:
+            remove_old_file()
+        migrated += len(remove_old_files)
+        last_id = videos[-1].id
+
+    print(f'{migrated} files migrated')
+
+
+def collect_garbage(dry_run: bool = False):
+    '''Removes video, thumbnail and spool files no longer referenced by the database'''
+    create_application().app_context().push()
+    from backend.media import sweeper
+    result = sweeper.sweep_orphans(dry_run=dry_run)
+    action = 'Would remove' if dry_run else 'Removed'
+    print(f'{action} {result.files_removed} files, reclaiming {result.bytes_reclaimed} bytes')
@@ -0,0 +1,60 @@
+import itertools
+import os
+
+import pytest
+
+os.environ.setdefault('JWT_KEY', 'test')
+os.environ.setdefault('ENCODING_RECOVERY_INTERVAL', '0')  # the database is created after the app
+os.environ.setdefault('QUERY_BUDGET_STRICT', '1')  # requests over their query budget fail the test
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('backend')
+    cwd = os.getcwd()
+    os.chdir(folder)  # the media folders are relative to the working directory
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{folder}/test.db'
+
+    import server
+    from backend import database as db
+    application = server.create_application()
+    application.testing = True
+    with application.app_context():
+        db.db.create_all()
+
+    yield application
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+_patients = itertools.count()
+
+
+def _signup_patient(app):
+    index = next(_patients)
+    email = f'test-patient{index}@mail.com'
+    client = app.test_client()
+    r = client.post('/api/v1/patient/signup',
+                    json=dict(email=email, name='patient', password='12345678', cpf=f'3{index}', remember_login=True))
+    assert r.status_code == 201, r.data
+
+    from backend import database as db
+    with app.app_context():
+        patient_id = db.Authorization.query.filter_by(email=email).one()._patient.id
+    return client, patient_id
+
+
+@pytest.fixture
+def patient(app):
+    '''A test client logged in as a new patient, and the patient's id'''
+    return _signup_patient(app)
+
+
+@pytest.fixture
+def other_patient(app):
+    '''Another patient, for access checks'''
+    return _signup_patient(app)
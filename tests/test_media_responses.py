@@ -0,0 +1,100 @@
+'''Conditional and byte range handling of the media responses'''
+import datetime
+
+import pytest
+
+from backend import database as db
+from backend import media
+from backend.constants import CONSTANTS
+from backend.media import storage
+
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def media_url(app):
+    return media.sign_media_url('video', storage.store_bytes(CONTENT, CONSTANTS.video_folder, '.mp4'))
+
+
+@pytest.fixture
+def video(app, patient):
+    '''A patient's client and the id of one of their videos'''
+    client, patient_id = patient
+    with app.app_context():
+        video = db.VideoInfo(video_path=storage.store_bytes(CONTENT, CONSTANTS.video_folder, '.mp4'),
+                             thumbnail_path=storage.store_bytes(b'thumbnail', CONSTANTS.thumbnail_folder, '.png'),
+                             date=datetime.datetime(2024, 1, 1), patient_id=patient_id)
+        db.db.session.add(video)
+        db.db.session.commit()
+        return client, video.id
+
+
+def test_full_content(client, media_url):
+    r = client.get(media_url)
+    assert r.status_code == 200
+    assert r.data == CONTENT
+    assert r.headers['Accept-Ranges'] == 'bytes'
+    assert r.headers['ETag']
+
+
+def test_range(client, media_url):
+    r = client.get(media_url, headers={'Range': 'bytes=0-3'})
+    assert r.status_code == 206
+    assert r.data == CONTENT[:4]
+    assert r.headers['Content-Range'] == f'bytes 0-3/{len(CONTENT)}'
+
+    r = client.get(media_url, headers={'Range': 'bytes=-10'})
+    assert r.status_code == 206
+    assert r.data == CONTENT[-10:]
+
+
+def test_unsatisfiable_range(client, media_url):
+    r = client.get(media_url, headers={'Range': f'bytes={len(CONTENT)}-'})
+    assert r.status_code == 416
+    assert r.headers['Content-Range'] == f'bytes */{len(CONTENT)}'
+
+
+def test_if_range(client, media_url):
+    etag = client.get(media_url).headers['ETag']
+    r = client.get(media_url, headers={'Range': 'bytes=0-3', 'If-Range': etag})
+    assert r.status_code == 206
+    r = client.get(media_url, headers={'Range': 'bytes=0-3', 'If-Range': '"stale"'})
+    assert r.status_code == 200
+    assert r.data == CONTENT
+
+
+def test_if_none_match(client, media_url):
+    etag = client.get(media_url).headers['ETag']
+    r = client.get(media_url, headers={'If-None-Match': etag})
+    assert r.status_code == 304
+    assert r.data == b''
+    assert client.get(media_url, headers={'If-None-Match': '"stale"'}).status_code == 200
+
+
+def test_revalidate(video):
+    client, video_id = video
+    r = client.get('/api/v1/video', query_string={'video_id': video_id})
+    assert r.status_code == 200
+    etag = r.headers['ETag']
+
+    assert client.get('/api/v1/video', query_string={'video_id': video_id},
+                      headers={'If-None-Match': etag}).status_code == 304
+    # the etag was issued for the video, not the thumbnail of the same id
+    assert client.get('/api/v1/thumbnail', query_string={'video_id': video_id},
+                      headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_revalidate_other_user(video, other_patient):
+    client, video_id = video
+    etag = client.get('/api/v1/video', query_string={'video_id': video_id}).headers['ETag']
+    other_client, _ = other_patient
+    assert other_client.get('/api/v1/video', query_string={'video_id': video_id},
+                            headers={'If-None-Match': etag}).status_code == 404
+
+
+@pytest.mark.parametrize('etag', ['"{id}.tag.é"', '"é"', '"{id}.1.2.3"', '"{id}"'])
+def test_revalidate_garbage(video, etag):
+    client, video_id = video
+    r = client.get('/api/v1/video', query_string={'video_id': video_id},
+                   headers={'If-None-Match': etag.format(id=video_id)})
+    assert r.status_code == 200
@@ -0,0 +1,58 @@
+'''Query counts of the endpoints that list linked users, to catch N+1 regressions'''
+import pytest
+
+from backend.constants import CONSTANTS
+from backend.database.instrumentation import QueryBudgetExceeded, assert_max_queries
+
+PATIENTS = 5
+
+
+def signup_patient(client, index: int):
+    r = client.post('/api/v1/patient/signup',
+                    json=dict(email=f'patient{index}@mail.com', name='patient', password='12345678', cpf=f'1{index}', remember_login=True))
+    assert r.status_code == 201, r.data
+
+
+def signup_professional(client):
+    r = client.post('/api/v1/professional/signup',
+                    json=dict(email='professional@mail.com', name='professional', password='12345678', cpf='2',
+                              registration_id='r2', institution='institution', remember_login=True))
+    assert r.status_code == 201, r.data
+
+
+@pytest.fixture(scope='module')
+def professional(app):
+    '''A professional linked to several patients'''
+    professional = app.test_client()
+    signup_professional(professional)
+    for index in range(PATIENTS):
+        patient = app.test_client()
+        signup_patient(patient, index)
+        assert professional.post('/api/v1/professional/link', json={'cpf': f'1{index}'}).status_code == 201
+        invite = patient.get('/api/v1/patient/link').json[0]
+        r = patient.post('/api/v1/patient/link', json={'professional_token': invite['token'], 'accept': True})
+        assert r.status_code == 200, r.data
+    return professional
+
+
+def test_professional_links(app, professional):
+    with app.app_context(), assert_max_queries(2):
+        r = professional.get('/api/v1/professional/link')
+    assert r.status_code == 200
+    assert len(r.json) == PATIENTS
+
+
+def test_professional_dashboard(app, professional):
+    with app.app_context(), assert_max_queries(2):
+        r = professional.get('/api/v1/professional/dashboard')
+    assert r.status_code == 200
+    assert len(r.json) == PATIENTS
+
+
+def test_query_budget(professional, monkeypatch):
+    monkeypatch.setattr(CONSTANTS, 'query_budgets', {'professionallinking': 2})
+    assert professional.get('/api/v1/professional/link').status_code == 200
+
+    monkeypatch.setattr(CONSTANTS, 'query_budgets', {'professionallinking': 1})
+    with pytest.raises(QueryBudgetExceeded):
+        professional.get('/api/v1/professional/link')
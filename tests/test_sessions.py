@@ -0,0 +1,79 @@
+'''Keyset pagination of the session listings'''
+import base64
+import datetime
+
+import pytest
+
+from backend import database as db
+
+SESSIONS = '/api/v1/patient/sessions'
+
+
+@pytest.fixture
+def sessions(app, patient):
+    '''A patient with sessions over a few days, two of them at the same instant.
+    Returns the client and the session ids, newest first'''
+    client, patient_id = patient
+    # the pair at the same instant falls across the first two pages of 2
+    dates = [datetime.datetime(2024, 1, day, 12) for day in (1, 2, 3, 3, 5)]
+    with app.app_context():
+        videos = [db.VideoInfo(video_path=f'{patient_id}-{i}.mp4', thumbnail_path=f'{patient_id}-{i}.png', date=date,
+                               patient_id=patient_id) for i, date in enumerate(dates)]
+        db.db.session.add_all(videos)
+        db.db.session.commit()
+        ordered = sorted(videos, key=lambda video: (video.date, video.id), reverse=True)
+        return client, [video.id for video in ordered]
+
+
+def _ids(page):
+    return [session['id'] for day in page['sessions'].values() for session in day]
+
+
+def test_pages_round_trip(sessions):
+    client, expected = sessions
+    pages = []
+    r = client.get(SESSIONS, query_string={'time_delta': 0, 'limit': 2})
+    while True:
+        assert r.status_code == 200, r.data
+        pages.append(_ids(r.json))
+        if r.json['next'] is None:
+            break
+        r = client.get(SESSIONS, query_string={'time_delta': 0, 'limit': 2, 'cursor': r.json['next']})
+
+    # days are keyed by timestamp, only the sessions of each page are compared in order
+    assert [sorted(page) for page in pages] == [sorted(expected[i:i + 2]) for i in range(0, len(expected), 2)]
+
+
+def test_limit_is_clamped(sessions):
+    client, expected = sessions
+    r = client.get(SESSIONS, query_string={'time_delta': 0, 'limit': 0})
+    assert r.status_code == 200, r.data
+    assert _ids(r.json) == expected[:1]
+    assert r.json['next'] is not None
+
+
+def test_unpaginated(sessions):
+    client, expected = sessions
+    r = client.get(SESSIONS, query_string={'time_delta': 0})
+    assert r.status_code == 200, r.data
+    assert 'next' not in r.json
+    assert sorted(_ids({'sessions': r.json})) == sorted(expected)
+
+
+@pytest.mark.parametrize('cursor', [
+    '!!!',
+    base64.urlsafe_b64encode(b'null').decode(),
+    base64.urlsafe_b64encode(b'[1]').decode(),
+    base64.urlsafe_b64encode(b'["x", 1]').decode(),
+    base64.urlsafe_b64encode(b'[["2024-01-01"], 1]').decode(),
+])
+def test_invalid_cursor(patient, cursor):
+    client, _ = patient
+    r = client.get(SESSIONS, query_string={'time_delta': 0, 'limit': 2, 'cursor': cursor})
+    assert r.status_code == 400, r.data
+
+
+def test_invalid_limit(patient):
+    client, _ = patient
+    r = client.get(SESSIONS, query_string={'time_delta': 0, 'limit': 'abc'})
+    assert r.status_code == 400, r.data
@@ -0,0 +1,62 @@
+'''Signed media urls, checked without database access'''
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from backend import media
+from backend.constants import CONSTANTS
+from backend.media import storage
+from backend.media.signing import MEDIA_ROUTE
+
+CONTENT = b'signed media content'
+
+
+@pytest.fixture
+def video_path(app):
+    return storage.store_bytes(CONTENT, CONSTANTS.video_folder, '.mp4')
+
+
+def _with_signature(url: str, signature: str) -> str:
+    parts = urlsplit(url)
+    expires = parse_qs(parts.query)['expires'][0]
+    return f'{parts.path}?expires={expires}&signature={signature}'
+
+
+def test_signed_url(client, video_path):
+    r = client.get(media.sign_media_url('video', video_path))
+    assert r.status_code == 200, r.data
+    assert r.data == CONTENT
+
+
+def test_unsigned_url(client, video_path):
+    assert client.get(f'{MEDIA_ROUTE}/video/{video_path}').status_code == 400
+    url = media.sign_media_url('video', video_path)
+    assert client.get(url.replace('/video/', '/thumbnail/')).status_code == 403
+    assert client.get(url.replace('/video/', '/other/')).status_code == 403
+
+
+def test_expired_url(client, video_path):
+    url = media.sign_media_url('video', video_path, now=time.time() - 3 * CONSTANTS.media_url_ttl)
+    assert client.get(url).status_code == 403
+
+
+@pytest.mark.parametrize('signature', ['0' * 64, '', 'é' * 64])
+def test_tampered_signature(client, video_path, signature):
+    url = _with_signature(media.sign_media_url('video', video_path), signature)
+    assert client.get(url).status_code == 403
+
+
+def test_signature_of_another_file(client, video_path):
+    other_path = storage.store_bytes(b'other content', CONSTANTS.video_folder, '.mp4')
+    other_signature = parse_qs(urlsplit(media.sign_media_url('video', other_path)).query)['signature'][0]
+    url = _with_signature(media.sign_media_url('video', video_path), other_signature)
+    assert client.get(url).status_code == 403
+
+
+@pytest.mark.parametrize('path', ['../test.db', 'ab/../../test.db'])
+def test_path_traversal(client, path):
+    # a signature is not enough to leave the media folder, the database sits right outside it
+    r = client.get(media.sign_media_url('video', path))
+    assert r.status_code == 404
+    assert not r.data.startswith(b'SQLite')
@@ -0,0 +1,107 @@
+'''Resumable uploads: chunk offsets and finalization'''
+import math
+import struct
+
+import pytest
+
+import backend.media
+
+SESSIONS = '/api/v1/patient/upload/session'
+
+
+def _frame(index: int, data: bytes) -> bytes:
+    return struct.pack('>IdI', index, math.nan, len(data)) + data
+
+
+BODY = b''.join(_frame(index, bytes([index]) * 100) for index in range(3))
+
+
+@pytest.fixture
+def submitted(monkeypatch):
+    '''The encoding jobs submitted, instead of encoding them'''
+    jobs = []
+    monkeypatch.setattr(backend.media, 'submit_encoding_job', lambda database_uri, job_id: jobs.append(job_id))
+    return jobs
+
+
+def _put(client, session_id: int, offset: int, data: bytes):
+    return client.put(f'{SESSIONS}/{session_id}', query_string={'offset': offset}, data=data,
+                      content_type='application/octet-stream')
+
+
+@pytest.fixture
+def session(patient):
+    '''A patient's client and a new upload session'''
+    client, _ = patient
+    r = client.post(SESSIONS)
+    assert r.status_code == 201, r.data
+    assert r.json['offset'] == 0
+    return client, r.json['session_id']
+
+
+def test_chunks(session):
+    client, session_id = session
+    half = len(BODY) // 2
+    r = _put(client, session_id, 0, BODY[:half])
+    assert r.status_code == 200, r.data
+    assert r.json['offset'] == half
+
+    # a retried chunk is harmless
+    assert _put(client, session_id, 0, BODY[:half]).json['offset'] == half
+    assert _put(client, session_id, half, BODY[half:]).json['offset'] == len(BODY)
+    assert client.get(f'{SESSIONS}/{session_id}').json['offset'] == len(BODY)
+
+
+@pytest.mark.parametrize('offset', [-1, 1])
+def test_offset_conflict(session, offset):
+    client, session_id = session
+    r = _put(client, session_id, offset, BODY)
+    assert r.status_code == 409
+    # the client resumes from the returned offset
+    assert r.json == {'session_id': session_id, 'offset': 0, 'job_id': None}
+
+
+def test_finalize(session, submitted):
+    client, session_id = session
+    _put(client, session_id, 0, BODY)
+
+    r = client.post(f'{SESSIONS}/{session_id}/finalize')
+    assert r.status_code == 202, r.data
+    job_id = r.json['job_id']
+    assert submitted == [job_id]
+
+    # finalizing again returns the same job without encoding it twice
+    r = client.post(f'{SESSIONS}/{session_id}/finalize')
+    assert r.status_code == 202, r.data
+    assert r.json['job_id'] == job_id
+    assert submitted == [job_id]
+
+    assert client.get(f'{SESSIONS}/{session_id}').json['job_id'] == job_id
+    assert _put(client, session_id, len(BODY), _frame(3, b'late')).status_code == 409
+
+
+def test_finalize_truncated(session, submitted):
+    client, session_id = session
+    _put(client, session_id, 0, BODY[:-1])
+    assert client.post(f'{SESSIONS}/{session_id}/finalize').status_code == 400
+    assert client.post(f'{SESSIONS}/{session_id}/finalize').status_code == 400
+    assert submitted == []
+
+    # the missing byte can still be sent
+    _put(client, session_id, len(BODY) - 1, BODY[-1:])
+    assert client.post(f'{SESSIONS}/{session_id}/finalize').status_code == 202
+
+
+def test_finalize_empty(session, submitted):
+    client, session_id = session
+    assert client.post(f'{SESSIONS}/{session_id}/finalize').status_code == 400
+    assert submitted == []
+
+
+def test_other_patient(session, other_patient, submitted):
+    _, session_id = session
+    other_client, _ = other_patient
+    assert other_client.get(f'{SESSIONS}/{session_id}').status_code == 404
+    assert _put(other_client, session_id, 0, BODY).status_code == 404
+    assert other_client.post(f'{SESSIONS}/{session_id}/finalize').status_code == 404
+    assert submitted == []